@@ -0,0 +1,576 @@
+import math
+import time
+import random
+import threading
+from collections import deque
+from typing import Optional, Dict, Callable, Any, Tuple
+
+class AQMQueue:
+    """Thread-safe queue with the same contract as PIEQueue, for pluggable AQM disciplines.
+
+    Subclasses decide per packet in O(1): `_admit` is called on enqueue (return
+    False for an early drop) and `_dequeue_packet` may drop packets at the head
+    before handing one out. Packets are stamped with `enqueue_time` so the
+    sojourn time is known at dequeue.
+    """
+
+    # Dynamic state saved by checkpoint.py, and absolute clock values among them
+    checkpoint_fields = ('packets', 'queued_bytes', 'drop_probability', 'stats')
+    clock_fields = ()
+
+    def __init__(self, capacity: int, processing_speed: int = 200000):
+        self.packets: deque = deque()
+        self.capacity = capacity
+        self.processing_speed = processing_speed  # bytes per second
+        self.queued_bytes = 0
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.drop_probability = 0.0
+        self.serving: Dict[int, Any] = {}  # Packets taken by `get` or `process_packets`, by consumer thread
+        self.stats = {
+            'total_packets': 0,
+            'total_processed': 0,
+            'total_dropped': 0,
+            'early_drops': 0,  # AQM drops on enqueue or at the head of the queue
+            'overflow_drops': 0,  # Tail drops on a full queue
+            'total_processing_time': 0,
+            'total_transmission_time': 0,
+            'total_queue_delay': 0,
+            'queue_delay_count': 0,
+            'last_queue_delay': 0.0
+        }
+
+    @property
+    def items(self) -> deque:
+        """Waiting packets, oldest first."""
+        return self.packets
+
+    def add_stat(self, name: str, value: float = 1) -> None:
+        """Add to a statistics counter under the queue lock."""
+        with self.lock:
+            self.stats[name] += value
+
+    def is_empty(self) -> bool:
+        """Check if the queue is empty."""
+        return len(self.items) == 0
+
+    def is_full(self) -> bool:
+        """Check if the queue is full."""
+        return len(self.items) >= self.capacity
+
+    def _admit(self, packet: Any, now: float) -> bool:
+        """Enqueue-side AQM decision; return False to drop the packet."""
+        return True
+
+    def _append(self, packet: Any, now: float) -> None:
+        """Store an admitted packet (lock held)."""
+        self.packets.append(packet)
+
+    def _pop_head(self) -> Optional[Any]:
+        """Remove the head packet or sentinel (lock held)."""
+        return self.packets.popleft()
+
+    def _head(self) -> Optional[Any]:
+        """Return the packet that would be dequeued next (lock held)."""
+        return self.packets[0]
+
+    def _remove(self, now: float) -> Optional[Any]:
+        """Pop the head and update the byte count (lock held)."""
+        packet = self._pop_head()
+        if packet is not None:
+            self.queued_bytes -= packet.data_length
+        return packet
+
+    def _record_sojourn(self, packet: Any, now: float) -> None:
+        """Record the queueing delay of a packet leaving the queue (lock held)."""
+        sojourn = now - packet.enqueue_time
+        self.stats['total_queue_delay'] += sojourn
+        self.stats['queue_delay_count'] += 1
+        self.stats['last_queue_delay'] = sojourn
+
+    def _drop_dequeued(self, packet: Any) -> None:
+        """Account for a packet dropped at the head of the queue (lock held)."""
+        self.stats['total_dropped'] += 1
+        self.stats['early_drops'] += 1
+
+    def _dequeue_packet(self, now: float) -> Optional[Any]:
+        """Dequeue-side AQM decision; None if every packet taken was dropped (lock held, head is a packet)."""
+        return self._remove(now)
+
+    def enqueue(self, packet: Optional[Any]) -> bool:
+        """Add a packet to the queue if the AQM admits it and there is space."""
+        with self.lock:
+            now = time.time()
+            if packet is None:
+                self._append(packet, now)
+                self.condition.notify()
+                return True
+            if not self._admit(packet, now):
+                self.stats['total_dropped'] += 1
+                self.stats['early_drops'] += 1
+                return False
+            if self.is_full():
+                self.stats['total_dropped'] += 1
+                self.stats['overflow_drops'] += 1
+                return False
+            packet.enqueue_time = now
+            packet.drop_probability = self.drop_probability
+            self._append(packet, now)
+            self.queued_bytes += packet.data_length
+            self.condition.notify()
+            return True
+
+    def requeue(self, packet: Any) -> None:
+        """Put a packet back at the head of the queue (used when resuming a checkpoint)."""
+        with self.lock:
+            self.packets.appendleft(packet)
+            self.queued_bytes += packet.data_length
+            self.condition.notify()
+
+    def shift_clock(self, delta: float) -> None:
+        """Move absolute timestamps forward by `delta` seconds after a restore."""
+        for name in self.clock_fields:
+            value = getattr(self, name)
+            if value:
+                setattr(self, name, value + delta)
+        for packet in self.items:
+            if packet is not None:
+                packet.enqueue_time += delta
+
+    def _next_packet(self) -> Optional[Any]:
+        """Remove the next packet, leaving the end-of-run sentinel in place (lock held)."""
+        while not self.is_empty() and self._head() is not None:
+            now = time.time()
+            packet = self._dequeue_packet(now)
+            if packet is not None:
+                self._record_sojourn(packet, now)
+                return packet
+        return None
+
+    def dequeue(self) -> Optional[Any]:
+        """Remove and return the next packet; None if empty or only the end-of-run sentinel is left."""
+        with self.lock:
+            return self._next_packet()
+
+    def get(self) -> Optional[Any]:
+        """Take the next packet into service, waiting while the queue is empty."""
+        with self.lock:
+            while True:
+                while self.is_empty():
+                    self.condition.wait()
+                if self._head() is None:
+                    return self._remove(time.time())
+                now = time.time()
+                packet = self._dequeue_packet(now)
+                if packet is not None:
+                    self._record_sojourn(packet, now)
+                    self.serving[threading.get_ident()] = packet
+                    return packet
+
+    def finish(self, on_finished: Optional[Callable[[Any], None]] = None, processed: bool = False) -> None:
+        """End the service of the packet the calling thread took with `get`.
+
+        `on_finished` records the packet, and `processed` counts it in
+        `total_processed`, in the same step under `lock`, so a checkpoint sees
+        it either in service or fully recorded.
+        """
+        with self.lock:
+            packet = self.serving.pop(threading.get_ident(), None)
+            if packet is None:
+                return
+            if processed:
+                self.stats['total_processed'] += 1
+            if on_finished is not None:
+                on_finished(packet)
+
+    def process_packets(self, sim_start_time: float,
+                        on_processed: Optional[Callable[[Any], None]] = None) -> Tuple[Optional[Any], str]:
+        """Dequeue and process the next packet, leaving the end-of-run sentinel in place.
+
+        The packet is counted, leaves `serving` and is passed to `on_processed`
+        in one step under `lock`, so a checkpoint sees it either in service or
+        fully recorded.
+        """
+        with self.lock:
+            current_packet = self._next_packet()
+            if current_packet is None:
+                return None, ""
+            self.serving[threading.get_ident()] = current_packet
+
+        current_packet.start_processing_time = time.time() - sim_start_time
+        time_to_process = current_packet.data_length / self.processing_speed
+        time.sleep(time_to_process)
+
+        current_packet.completion_time = time.time() - sim_start_time
+        with self.lock:
+            self.stats['total_processing_time'] += time_to_process
+            self.stats['total_processed'] += 1
+            self.serving.pop(threading.get_ident(), None)
+            if on_processed is not None:
+                on_processed(current_packet)
+        return current_packet, ""
+
+    def controller_stats(self) -> Dict[str, float]:
+        """Controller state exported with the results."""
+        return {'drop_probability': self.drop_probability}
+
+class REDQueue(AQMQueue):
+    """Random Early Detection (Floyd & Jacobson 1993) with optional gentle mode.
+
+    Thresholds are in packets and default to 20% and 60% of the capacity.
+    """
+
+    checkpoint_fields = AQMQueue.checkpoint_fields + ('average_queue', 'count', 'idle_since')
+    clock_fields = ('idle_since',)
+
+    def __init__(self, capacity: int, processing_speed: int = 200000,
+                 min_threshold: Optional[float] = None, max_threshold: Optional[float] = None,
+                 max_p: float = 0.1, weight: float = 0.002, gentle: bool = False,
+                 mean_packet_size: int = 1000):
+        super().__init__(capacity, processing_speed)
+        self.min_threshold = min_threshold if min_threshold is not None else capacity * 0.2
+        self.max_threshold = max_threshold if max_threshold is not None else capacity * 0.6
+        self.max_p = max_p
+        self.weight = weight  # EWMA weight of the average queue size
+        self.gentle = gentle
+        self.mean_service_time = mean_packet_size / processing_speed
+        self.average_queue = 0.0
+        self.count = -1  # Packets since the last early drop
+        self.idle_since: Optional[float] = None
+        self.stats['forced_drops'] = 0  # Early drops with the average above max_threshold
+
+    def _update_average(self, now: float) -> None:
+        """Update the EWMA queue size, decaying it across idle periods."""
+        if self.is_empty() and self.idle_since is not None:
+            idle_packets = (now - self.idle_since) / self.mean_service_time
+            self.average_queue *= (1 - self.weight) ** idle_packets
+            self.idle_since = None
+        else:
+            self.average_queue += self.weight * (len(self.items) - self.average_queue)
+
+    def _base_probability(self) -> Optional[float]:
+        """Return p_b for the current average, or None when every packet must be dropped."""
+        avg = self.average_queue
+        if avg < self.min_threshold:
+            return 0.0
+        if avg < self.max_threshold:
+            return self.max_p * (avg - self.min_threshold) / (self.max_threshold - self.min_threshold)
+        if self.gentle and avg < 2 * self.max_threshold:
+            return self.max_p + (1 - self.max_p) * (avg - self.max_threshold) / self.max_threshold
+        return None
+
+    def _admit(self, packet: Any, now: float) -> bool:
+        self._update_average(now)
+        p_b = self._base_probability()
+        if p_b is None:
+            self.drop_probability = 1.0
+            self.count = 0
+            self.stats['forced_drops'] += 1
+            return False
+        if p_b == 0.0:
+            self.drop_probability = 0.0
+            self.count = -1
+            return True
+        self.count += 1
+        # Spread drops evenly: p_a grows with the packets since the last drop
+        denominator = 1 - self.count * p_b
+        p_a = 1.0 if denominator <= 0 else min(p_b / denominator, 1.0)
+        self.drop_probability = p_a
+        if random.random() < p_a:
+            self.count = 0
+            return False
+        return True
+
+    def _remove(self, now: float) -> Optional[Any]:
+        packet = super()._remove(now)
+        if self.is_empty():
+            self.idle_since = now
+        return packet
+
+    def controller_stats(self) -> Dict[str, float]:
+        return {
+            'average_queue': self.average_queue,
+            'max_p': self.max_p,
+            'drop_probability': self.drop_probability,
+            'forced_drops': self.stats['forced_drops']
+        }
+
+class AdaptiveREDQueue(REDQueue):
+    """Adaptive RED (Floyd, Gummadi & Shenker 2001): AIMD tuning of max_p every `adapt_interval`.
+
+    max_p is adjusted so the average queue stays in the middle 20% of the
+    [min_threshold, max_threshold] band. Gentle mode is on by default.
+    """
+
+    checkpoint_fields = REDQueue.checkpoint_fields + ('max_p', 'last_adapt_time', 'adaptations')
+    clock_fields = REDQueue.clock_fields + ('last_adapt_time',)
+
+    def __init__(self, capacity: int, processing_speed: int = 200000,
+                 min_threshold: Optional[float] = None, max_threshold: Optional[float] = None,
+                 max_p: float = 0.1, weight: float = 0.002, gentle: bool = True,
+                 mean_packet_size: int = 1000, adapt_interval: float = 0.5, decrease_factor: float = 0.9):
+        super().__init__(capacity, processing_speed, min_threshold, max_threshold,
+                         max_p, weight, gentle, mean_packet_size)
+        self.adapt_interval = adapt_interval
+        self.decrease_factor = decrease_factor
+        self.last_adapt_time = 0.0
+        self.adaptations = 0
+
+    def _adapt(self, now: float) -> None:
+        """Nudge max_p towards keeping the average queue inside the target band."""
+        if now - self.last_adapt_time < self.adapt_interval:
+            return
+        self.last_adapt_time = now
+        band = self.max_threshold - self.min_threshold
+        target_low = self.min_threshold + 0.4 * band
+        target_high = self.min_threshold + 0.6 * band
+        if self.average_queue > target_high and self.max_p <= 0.5:
+            self.max_p += min(0.01, self.max_p / 4)
+            self.adaptations += 1
+        elif self.average_queue < target_low and self.max_p >= 0.01:
+            self.max_p *= self.decrease_factor
+            self.adaptations += 1
+
+    def _admit(self, packet: Any, now: float) -> bool:
+        self._adapt(now)
+        return super()._admit(packet, now)
+
+    def controller_stats(self) -> Dict[str, float]:
+        stats = super().controller_stats()
+        stats['adaptations'] = self.adaptations
+        return stats
+
+class CoDelQueue(AQMQueue):
+    """Controlled Delay AQM (RFC 8289): head drops when sojourn time stays above target for an interval."""
+
+    checkpoint_fields = AQMQueue.checkpoint_fields + (
+        'first_above_time', 'drop_next', 'count', 'last_count', 'dropping', 'last_sojourn')
+    clock_fields = ('first_above_time', 'drop_next')
+
+
+    def __init__(self, capacity: int, processing_speed: int = 200000,
+                 target: float = 0.005, interval: float = 0.1, mtu: int = 1514):
+        super().__init__(capacity, processing_speed)
+        self.target = target  # Acceptable standing queue delay in seconds
+        self.interval = interval  # Sliding minimum window in seconds
+        self.mtu = mtu  # Never drop when less than one MTU is queued
+        self.first_above_time = 0.0
+        self.drop_next = 0.0
+        self.count = 0
+        self.last_count = 0
+        self.dropping = False
+        self.last_sojourn = 0.0
+
+    def _control_law(self, t: float) -> float:
+        """Next drop time: the interval shrinks with the square root of the drop count."""
+        return t + self.interval / math.sqrt(self.count)
+
+    def _do_dequeue(self, now: float) -> Tuple[Optional[Any], bool]:
+        """Pop the head and report whether CoDel may drop it."""
+        packet = self._remove(now)
+        if packet is None:
+            return None, False
+        self.last_sojourn = now - packet.enqueue_time
+        if self.last_sojourn < self.target or self.queued_bytes <= self.mtu:
+            self.first_above_time = 0.0
+            return packet, False
+        if self.first_above_time == 0.0:
+            self.first_above_time = now + self.interval
+            return packet, False
+        return packet, now >= self.first_above_time
+
+    def _next(self, now: float) -> Tuple[Optional[Any], bool]:
+        """Pop the next real packet, stopping at the end-of-run sentinel."""
+        if self.is_empty() or self._head() is None:
+            self.first_above_time = 0.0
+            return None, False
+        return self._do_dequeue(now)
+
+    def _dequeue_packet(self, now: float) -> Optional[Any]:
+        packet, ok_to_drop = self._next(now)
+        if packet is None:
+            self.dropping = False
+            return None
+        if self.dropping:
+            if not ok_to_drop:
+                self.dropping = False
+            while self.dropping and now >= self.drop_next:
+                self._drop_dequeued(packet)
+                self.count += 1
+                packet, ok_to_drop = self._next(now)
+                if packet is None or not ok_to_drop:
+                    self.dropping = False
+                else:
+                    self.drop_next = self._control_law(self.drop_next)
+        elif ok_to_drop:
+            self._drop_dequeued(packet)
+            packet, _ = self._next(now)
+            self.dropping = True
+            delta = self.count - self.last_count
+            # Resume near the previous drop rate if we were dropping recently
+            if delta > 1 and now - self.drop_next < 16 * self.interval:
+                self.count = delta
+            else:
+                self.count = 1
+            self.drop_next = self._control_law(now)
+            self.last_count = self.count
+        return packet
+
+    def controller_stats(self) -> Dict[str, float]:
+        return {
+            'dropping': float(self.dropping),
+            'count': self.count,
+            'last_sojourn': self.last_sojourn,
+            'target': self.target,
+            'interval': self.interval
+        }
+
+class DualPI2Queue(AQMQueue):
+    """DualPI2 coupled dual-queue AQM (RFC 9332) for L4S and Classic traffic.
+
+    A PI controller on the queue delay gives a base probability p'. Classic
+    packets are dropped with p' squared; L4S packets are CE-marked with the
+    coupled probability k * p' or, at least, when their own sojourn exceeds a
+    shallow step threshold. A time-shifted FIFO scheduler gives the L queue
+    priority by `time_shift`. `l4s_classifier` selects L4S packets, by default
+    those with `ecn_capable` set.
+
+    Overload (RFC 9332 section 4.2.3): once p_CL saturates at
+    `l4s_max_probability`, marking can no longer slow L4S senders down (and
+    replayed traces never react to CE), so L4S packets are also dropped with
+    p_C, as Classic ones, and the rest marked. This keeps unresponsive L4S
+    traffic from taking the whole buffer.
+    """
+
+    checkpoint_fields = ('l_queue', 'c_queue', 'queued_bytes', 'drop_probability', 'stats',
+                         'base_probability', 'previous_delay', 'last_update_time')
+    clock_fields = ('last_update_time',)
+
+    def __init__(self, capacity: int, processing_speed: int = 200000,
+                 target: float = 0.015, update_interval: float = 0.016,
+                 alpha: float = 0.16, beta: float = 3.2, coupling: float = 2.0,
+                 step_threshold: float = 0.001, time_shift: float = 0.04,
+                 l4s_max_probability: float = 1.0,
+                 l4s_classifier: Optional[Callable[[Any], bool]] = None):
+        super().__init__(capacity, processing_speed)
+        self.l_queue: deque = deque()
+        self.c_queue: deque = deque()
+        self.target = target  # Classic queue delay target in seconds
+        self.update_interval = update_interval
+        self.alpha = alpha  # Integral gain (Hz), applied as alpha * update_interval per update
+        self.beta = beta  # Proportional gain (Hz), applied as beta * update_interval per update
+        self.coupling = coupling  # k in p_CL = k * p'
+        self.step_threshold = step_threshold  # Native L4S marking threshold in seconds
+        self.time_shift = time_shift
+        self.l4s_max_probability = l4s_max_probability  # p_Lmax: p_CL at which the queue is overloaded
+        self.l4s_classifier = l4s_classifier or (lambda packet: getattr(packet, 'ecn_capable', False))
+        self.base_probability = 0.0  # p'
+        self.previous_delay = 0.0
+        self.last_update_time = 0.0
+        self.stats.update({'l4s_packets': 0, 'classic_packets': 0, 'ce_marks': 0, 'classic_drops': 0,
+                           'overload_drops': 0})
+
+    @property
+    def items(self) -> list:
+        """Packets waiting in both queues (for statistics only)."""
+        return list(self.l_queue) + list(self.c_queue)
+
+    def is_empty(self) -> bool:
+        return not self.l_queue and not self.c_queue
+
+    def requeue(self, packet: Any) -> None:
+        with self.lock:
+            (self.l_queue if packet.l4s else self.c_queue).appendleft(packet)
+            self.queued_bytes += packet.data_length
+            self.condition.notify()
+
+    def is_full(self) -> bool:
+        return len(self.l_queue) + len(self.c_queue) >= self.capacity
+
+    @property
+    def classic_probability(self) -> float:
+        """p_C = p'^2."""
+        return self.base_probability ** 2
+
+    @property
+    def coupled_probability(self) -> float:
+        """p_CL = k * p', capped at 1."""
+        return min(self.coupling * self.base_probability, 1.0)
+
+    @property
+    def overloaded(self) -> bool:
+        """True while p_CL is saturated and L4S packets are dropped like Classic ones."""
+        return self.coupled_probability >= self.l4s_max_probability
+
+    def _queue_delay(self, queue: deque, now: float) -> float:
+        """Sojourn time of the head of a queue."""
+        return now - queue[0].enqueue_time if queue and queue[0] is not None else 0.0
+
+    def _update_controller(self, now: float) -> None:
+        """PI update of p' every `update_interval`, driven by the larger head sojourn (RFC 9332 alpha_U, beta_U)."""
+        if now - self.last_update_time < self.update_interval:
+            return
+        self.last_update_time = now
+        delay = max(self._queue_delay(self.c_queue, now), self._queue_delay(self.l_queue, now))
+        self.base_probability += self.update_interval * (self.alpha * (delay - self.target) +
+                                                         self.beta * (delay - self.previous_delay))
+        self.base_probability = max(0.0, min(1.0, self.base_probability))
+        self.previous_delay = delay
+        self.drop_probability = self.classic_probability
+
+    def _admit(self, packet: Any, now: float) -> bool:
+        self._update_controller(now)
+        packet.l4s = self.l4s_classifier(packet)
+        if packet.l4s:
+            self.stats['l4s_packets'] += 1
+            if self.overloaded and random.random() < self.classic_probability:
+                self.stats['overload_drops'] += 1
+                return False
+            return True
+        self.stats['classic_packets'] += 1
+        if random.random() < self.classic_probability:
+            self.stats['classic_drops'] += 1
+            return False
+        return True
+
+    def _append(self, packet: Any, now: float) -> None:
+        if packet is not None and packet.l4s:
+            self.l_queue.append(packet)
+        else:
+            self.c_queue.append(packet)
+
+    def _serve_l4s(self) -> bool:
+        """Time-shifted FIFO: L4S wins unless the classic head is older by more than time_shift."""
+        if not self.l_queue:
+            return False
+        if not self.c_queue or self.c_queue[0] is None:
+            return True
+        return self.l_queue[0].enqueue_time - self.time_shift <= self.c_queue[0].enqueue_time
+
+    def _head(self) -> Optional[Any]:
+        return self.l_queue[0] if self._serve_l4s() else self.c_queue[0]
+
+    def _pop_head(self) -> Optional[Any]:
+        return self.l_queue.popleft() if self._serve_l4s() else self.c_queue.popleft()
+
+    def _dequeue_packet(self, now: float) -> Optional[Any]:
+        packet = self._remove(now)
+        if packet is not None and packet.l4s:
+            sojourn = now - packet.enqueue_time
+            if sojourn > self.step_threshold or random.random() < self.coupled_probability:
+                packet.ce_marked = True
+                self.stats['ce_marks'] += 1
+        return packet
+
+    def controller_stats(self) -> Dict[str, float]:
+        return {
+            'base_probability': self.base_probability,
+            'classic_probability': self.classic_probability,
+            'coupled_probability': self.coupled_probability,
+            'l_queue': len(self.l_queue),
+            'c_queue': len(self.c_queue),
+            'ce_marks': self.stats['ce_marks'],
+            'classic_drops': self.stats['classic_drops'],
+            'overloaded': float(self.overloaded),
+            'overload_drops': self.stats['overload_drops']
+        }
@@ -0,0 +1,165 @@
+import os
+import time
+import zlib
+import pickle
+import random
+import threading
+from itertools import islice
+from collections import deque
+from contextlib import ExitStack
+from typing import Optional, List, Dict, Any, Iterable
+
+SNAPSHOT_VERSION = 1
+_THREADING_TYPES = (type(threading.Lock()), type(threading.RLock()), threading.Condition,
+                    threading.Event, threading.Thread)
+
+def object_state(obj: Any, fields: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """Return the named attributes of `obj`, or all of them except locks and callables."""
+    names = fields if fields is not None else list(vars(obj))
+    state = {}
+    for name in names:
+        value = getattr(obj, name)
+        if isinstance(value, _THREADING_TYPES) or callable(value):
+            continue
+        state[name] = value
+    return state
+
+def _queues(simulation: Any) -> List[Any]:
+    """Every packet queue of a simulation, in pool order."""
+    if simulation.service_pool is not None:
+        return simulation.service_pool.queues
+    return [simulation.packet_queue]
+
+def _queue_fields(queue: Any) -> Dict[str, Any]:
+    """Checkpoint fields of a queue, without the end-of-run sentinels of closed deque queues."""
+    fields = object_state(queue, queue.checkpoint_fields)
+    for name, value in fields.items():
+        if isinstance(value, deque):
+            fields[name] = deque(packet for packet in value if packet is not None)
+    return fields
+
+def _in_service(queues: List[Any]) -> List[tuple]:
+    """(queue index, packet) for packets taken off a queue but not finished yet (queue locks held)."""
+    return [(index, packet) for index, queue in enumerate(queues) for packet in queue.serving.values()]
+
+def _picklable_trace(trace: Any) -> Any:
+    """Keep a trace description in the snapshot when it can be pickled (not a generator)."""
+    if trace is None:
+        return None
+    try:
+        pickle.dumps(trace)
+        return trace
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None
+
+def capture_simulation(simulation: Any) -> bytes:
+    """Serialise the state of a (possibly running) simulation.
+
+    Packet generation is paused through `checkpoint_lock` and every queue lock
+    is held while the state is pickled. Queues record the packets taken by
+    `get` under the same lock, so every packet is either waiting, in service
+    or finished in the snapshot.
+    """
+    queues = _queues(simulation)
+    with ExitStack() as stack:
+        stack.enter_context(simulation.checkpoint_lock)
+        for queue in queues:
+            stack.enter_context(queue.lock)
+        pool = simulation.service_pool
+        state = {
+            'version': SNAPSHOT_VERSION,
+            'saved_at': time.time(),
+            'elapsed': time.time() - simulation.sim_start_time,
+            'config': simulation.config,
+            'trace': _picklable_trace(simulation.trace),
+            'trace_position': simulation.trace_position,
+            'random': random.getstate(),
+            'queues': [
+                {'class': type(queue).__name__,
+                 'fields': _queue_fields(queue),
+                 'waiting': [packet for packet in queue.items if packet is not None]}
+                for queue in queues
+            ],
+            'in_service': _in_service(queues),
+            'pool': None if pool is None else {
+                'stats': pool.stats,
+                'next_unit': pool.next_unit,
+                'units': [unit.stats for unit in pool.units]
+            },
+            'delay_estimator': object_state(simulation.delay_estimator),
+            'drop_estimator': object_state(simulation.drop_estimator),
+            'delay_histogram': object_state(simulation.delay_histogram),
+            'traffic': simulation.traffic.snapshot(),
+            'stats_collector': object_state(simulation.stats_collector),
+            'event_count': simulation.event_logger.event_count
+        }
+        return pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+
+def save_snapshot(path: str, payload: bytes) -> None:
+    """Write a compressed snapshot atomically, so an interrupted save keeps the previous one."""
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(zlib.compress(payload, 6))
+    os.replace(temporary, path)
+
+def load_snapshot(path: str) -> Dict[str, Any]:
+    """Read a snapshot written by `save_snapshot`."""
+    with open(path, 'rb') as f:
+        state = pickle.loads(zlib.decompress(f.read()))
+    if state.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version {state.get('version')} in '{path}'")
+    return state
+
+def restore_simulation(simulation: Any, state: Dict[str, Any]) -> None:
+    """Load a snapshot into a freshly constructed simulation before `run()`.
+
+    Queue controller state is restored only when the queue class matches the
+    snapshot; otherwise (a what-if fork with another AQM) the waiting packets
+    are offered to the new queue and its controller starts fresh. Absolute
+    clock values are shifted by the time spent between save and restore.
+    """
+    shift = time.time() - state['saved_at']
+    simulation.sim_start_time = time.time() - state['elapsed']
+    simulation.event_logger.start_time = simulation.sim_start_time
+    simulation.event_logger.event_count = state['event_count']
+    random.setstate(state['random'])
+
+    queues = _queues(simulation)
+    if len(queues) != len(state['queues']):
+        raise ValueError("Checkpoint was taken with a different number of queues")
+    for queue, saved in zip(queues, state['queues']):
+        if type(queue).__name__ == saved['class']:
+            for name, value in saved['fields'].items():
+                setattr(queue, name, value)
+            queue.shift_clock(shift)
+        else:
+            stats = queue.stats
+            stats.update({k: v for k, v in saved['fields']['stats'].items() if k in stats})
+            queue.stats = stats
+            for packet in saved['waiting']:
+                if packet is not None:
+                    queue.enqueue(packet)
+    for index, packet in reversed(state['in_service']):
+        if getattr(packet, 'enqueue_time', 0):
+            packet.enqueue_time += shift
+        queues[index].requeue(packet)
+
+    pool = state['pool']
+    if pool is not None:
+        simulation.service_pool.stats = pool['stats']
+        simulation.service_pool.next_unit = pool['next_unit']
+        for unit, unit_stats in zip(simulation.service_pool.units, pool['units']):
+            unit.stats.update(unit_stats)
+
+    vars(simulation.delay_estimator).update(state['delay_estimator'])
+    vars(simulation.drop_estimator).update(state['drop_estimator'])
+    vars(simulation.delay_histogram).update(state['delay_histogram'])
+    simulation.traffic.reset(state['traffic'])
+    vars(simulation.stats_collector).update(state['stats_collector'])
+
+    # Continue the trace after the last packet generated before the snapshot
+    packets_data = simulation.packets_data
+    if state['trace_position'] is not None and hasattr(packets_data, 'resume_at'):
+        simulation.packets_data = packets_data.resume_at(state['trace_position'])
+    else:
+        simulation.packets_data = islice(packets_data, simulation.packet_queue.stats['total_packets'], None)
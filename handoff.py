@@ -0,0 +1,157 @@
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+_VACANT = object()  # Marks a slot already taken by the consumer
+
+class SPSCRing:
+    """Bounded single-producer/single-consumer ring buffer with batched wakeups.
+
+    `tail` is only written by the producer and `head` only by the consumer, so
+    neither side takes a lock to hand a packet over. A consumer that finds the
+    ring empty raises `waiting` and parks on an Event; the producer sets the
+    event only when it sees that flag, so a consumer that keeps up drains
+    whole batches without a single wakeup. `close()` ends the stream in place
+    of an in-band sentinel.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.slots: List[Any] = [_VACANT] * capacity
+        self.head = 0  # Next slot to read (consumer)
+        self.tail = 0  # Next slot to write (producer)
+        self.closed = False
+        self.waiting = False
+        self.ready = threading.Event()
+        self.wakeups = 0  # Consumer wakeups signalled by the producer
+
+    def __len__(self) -> int:
+        head = self.head  # Read before tail so the result is never negative
+        return self.tail - head
+
+    def push(self, item: Any) -> bool:
+        """Append an item (producer only); False if the ring is full."""
+        tail = self.tail
+        if tail - self.head >= self.capacity:
+            return False
+        self.slots[tail % self.capacity] = item
+        self.tail = tail + 1  # Publish only once the slot is written
+        if self.waiting:
+            self.waiting = False
+            self.wakeups += 1
+            self.ready.set()
+        return True
+
+    def peek(self) -> Optional[Any]:
+        """Return the oldest item without removing it (consumer only; see `oldest`)."""
+        head = self.head
+        if head == self.tail:
+            return None
+        return self.slots[head % self.capacity]
+
+    def oldest(self) -> Optional[Any]:
+        """Return the oldest item as seen from any thread, or None if empty.
+
+        The consumer may take the item concurrently, in which case its slot
+        already reads as vacant and None is returned; the result is never a
+        placeholder. Only the producer refills slots, so from the producer
+        the item returned was at the head an instant before.
+        """
+        head = self.head
+        if head == self.tail:
+            return None
+        item = self.slots[head % self.capacity]
+        return None if item is _VACANT else item
+
+    def pop(self) -> Optional[Any]:
+        """Remove and return the oldest item, or None if empty (consumer only)."""
+        head = self.head
+        if head == self.tail:
+            return None
+        slot = head % self.capacity
+        item = self.slots[slot]
+        self.slots[slot] = _VACANT
+        self.head = head + 1
+        return item
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Park the consumer until the producer pushes or closes the ring."""
+        self.ready.clear()
+        self.waiting = True
+        if self.head == self.tail and not self.closed:
+            self.ready.wait(timeout)
+
+    def close(self) -> None:
+        """Mark the end of the stream and wake every parked consumer."""
+        self.closed = True
+        self.ready.set()
+
+    def snapshot(self) -> List[Any]:
+        """Copy of the items currently held, oldest first (safe from any thread)."""
+        head, tail = self.head, self.tail
+        items = [self.slots[i % self.capacity] for i in range(head, tail)]
+        return [item for item in items if item is not _VACANT]
+
+    def reset(self, items: Iterable[Any]) -> None:
+        """Replace the contents; only while neither side is running (checkpoint restore).
+
+        The ring grows when the items do not fit: packets that were in service
+        go back on top of a queue that may already be full.
+        """
+        items = list(items)
+        self.capacity = max(self.capacity, len(items))
+        self.slots = items + [_VACANT] * (self.capacity - len(items))
+        self.head = 0
+        self.tail = len(items)
+
+class ThreadCounters:
+    """Statistics counters accumulated per thread and merged when read.
+
+    Each writing thread adds into its own shard, so counters never share a
+    dict or a lock between threads; `snapshot()` sums the shards. Gauges hold
+    the last value set and are expected to have a single writer each.
+    """
+
+    def __init__(self, initial: Dict[str, float], gauges: Iterable[str] = ()):
+        self.gauges = {name: initial[name] for name in gauges}
+        self.base = {name: value for name, value in initial.items() if name not in self.gauges}
+        self.shards: List[Dict[str, float]] = []
+        self._local = threading.local()
+        self._register_lock = threading.Lock()
+
+    def _shard(self) -> Dict[str, float]:
+        """Return the calling thread's shard, registering it on first use."""
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = dict.fromkeys(self.base, 0)
+            with self._register_lock:
+                self.shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def add(self, name: str, value: float = 1) -> None:
+        """Add to a counter from the calling thread."""
+        self._shard()[name] += value
+
+    def set(self, name: str, value: float) -> None:
+        """Set a gauge."""
+        self.gauges[name] = value
+
+    def snapshot(self) -> Dict[str, float]:
+        """Merged totals of every shard plus the current gauges."""
+        totals = dict(self.base)
+        for shard in list(self.shards):
+            for name, value in list(shard.items()):
+                totals[name] += value
+        totals.update(self.gauges)
+        return totals
+
+    def reset(self, values: Dict[str, float]) -> None:
+        """Restart from the given totals (checkpoint restore)."""
+        for shard in self.shards:
+            for name in shard:
+                shard[name] = 0
+        for name, value in values.items():
+            if name in self.gauges:
+                self.gauges[name] = value
+            elif name in self.base:
+                self.base[name] = value
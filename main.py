@@ -3,12 +3,19 @@ import time
 import sys
 import threading
 import csv
+import argparse
 import matplotlib.pyplot as plt
 from datetime import datetime
 from dataclasses import dataclass
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Iterable, Callable
 from queue import Queue as ThreadQueue
 from abc import ABC, abstractmethod
+from service_pool import ServicePool, ServiceUnit
+from online_stats import BatchMeansEstimator
+from timeseries import RollupSeries, SlidingWindowRate
+from metrics_server import MetricsExporter, DelayHistogram
+from handoff import SPSCRing, ThreadCounters
+import checkpoint
 
 @dataclass
 class Packet:
@@ -20,6 +27,7 @@ class Packet:
     start_processing_time: float = 0
     completion_time: float = 0
     delete_time: float = 0
+    flow: Optional[tuple] = None  # (ip_src, ip_dst, src_port, dst_port, proto) when replayed from a trace
 
     def __str__(self) -> str:
         return f"Packet {self.packet_id} (size: {self.data_length} bytes)"
@@ -27,11 +35,14 @@ class Packet:
 class EventLogger:
     """Handles logging of simulation events with thread-safe operations."""
     
-    def __init__(self, start_time: float):
+    def __init__(self, start_time: float, quiet: bool = False):
         self.lock = threading.Lock()
         self.start_time = start_time
+        self.event_count = 0  # Read without the lock by the metrics exporter
         self.events_file = "fifo_events.txt"
-        self._initialize_log_file()
+        self.quiet = quiet  # Count events only, e.g. in optimizer trials
+        if not quiet:
+            self._initialize_log_file()
 
     def _initialize_log_file(self) -> None:
         """Initialize the log file with a header."""
@@ -48,6 +59,9 @@ class EventLogger:
     def log_event(self, event: str) -> None:
         """Log an event with timestamp to both console and file."""
         with self.lock:
+            self.event_count += 1
+            if self.quiet:
+                return
             timestamp = self._get_elapsed_time()
             log_message = f"{timestamp} - {event}"
             print(log_message)
@@ -71,61 +85,163 @@ class NetworkLink:
             return transmission_time
 
 class PacketQueue:
-    """Thread-safe queue for managing network packets."""
+    """Packet queue handing packets from the generator to the processor through an SPSC ring.
+
+    `get`, `dequeue` and `process_packets` run on the consumer side, where
+    `lock` is taken only to serialise several consumers (a shared service
+    pool) and checkpoints. The single-server loop puts transmitted packets
+    back with `put_back`, so pushes are serialised by `producer_lock` (taken
+    after `lock` there); receiving a packet never takes it. Packets taken by
+    `get` stay in `serving` until `finish` or `put_back`. Statistics are
+    per-thread counters read through `stats`.
+    """
     
+    # Dynamic state saved by checkpoint.py, and absolute clock values among them
+    checkpoint_fields = ('items', 'queued_bytes', 'stats')
+    clock_fields = ()
+
     def __init__(self, capacity: int, processing_speed: int = 200000):
-        self.items: List[Packet] = []
+        self.ring = SPSCRing(capacity)
         self.capacity = capacity
         self.processing_speed = processing_speed  # bytes per second
+        self.bytes_in = 0  # Written under producer_lock
+        self.bytes_out = 0  # Written by the consumer only
         self.lock = threading.Lock()
-        self.condition = threading.Condition(self.lock)
-        self.stats = {
+        self.producer_lock = threading.Lock()
+        self.serving: Dict[int, Packet] = {}  # Packets taken by `get`, by consumer thread
+        self.counters = ThreadCounters({
             'total_packets': 0,
             'total_processed': 0,
             'total_dropped': 0,
+            'early_drops': 0,  # Always 0 for tail-drop, kept for a common layout
+            'overflow_drops': 0,
             'total_processing_time': 0,
             'total_transmission_time': 0
-        }
+        })
+
+    @property
+    def items(self) -> List[Packet]:
+        """Snapshot of the waiting packets, oldest first."""
+        return self.ring.snapshot()
+
+    @items.setter
+    def items(self, packets: List[Packet]) -> None:
+        self.ring.reset(packets)
+        self.bytes_in = sum(packet.data_length for packet in packets)
+        self.bytes_out = 0
+
+    @property
+    def queued_bytes(self) -> int:
+        """Bytes waiting in the queue."""
+        bytes_out = self.bytes_out
+        return self.bytes_in - bytes_out
+
+    @queued_bytes.setter
+    def queued_bytes(self, value: int) -> None:
+        self.bytes_in = self.bytes_out + value
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        """Merged statistics counters."""
+        return self.counters.snapshot()
+
+    @stats.setter
+    def stats(self, values: Dict[str, float]) -> None:
+        self.counters.reset(values)
+
+    def add_stat(self, name: str, value: float = 1) -> None:
+        """Add to a statistics counter from any thread."""
+        self.counters.add(name, value)
 
     def is_empty(self) -> bool:
         """Check if the queue is empty."""
-        return len(self.items) == 0
+        return len(self.ring) == 0
 
     def is_full(self) -> bool:
         """Check if the queue is full."""
-        return len(self.items) == self.capacity
+        return len(self.ring) >= self.capacity
 
     def enqueue(self, packet: Optional[Packet]) -> bool:
-        """Add a packet to the queue if there's space."""
-        with self.lock:
-            if packet is None or not self.is_full():
-                self.items.append(packet)
-                self.condition.notify()
+        """Add a packet to the queue if there's space; None ends the stream."""
+        if packet is None:
+            self.ring.close()
+            return True
+        with self.producer_lock:
+            if not self.is_full():
+                self.bytes_in += packet.data_length
+                self.ring.push(packet)
                 return True
-            if packet is not None:
-                self.stats['total_dropped'] += 1
-            return False
+        self.counters.add('total_dropped')
+        self.counters.add('overflow_drops')
+        return False
+
+    def requeue(self, packet: Packet) -> None:
+        """Put a packet back at the head of the queue (used when resuming a checkpoint)."""
+        self.items = [packet] + self.items
+
+    def shift_clock(self, delta: float) -> None:
+        """Move absolute timestamps forward by `delta` seconds after a restore."""
+        for name in self.clock_fields:
+            value = getattr(self, name)
+            if value:
+                setattr(self, name, value + delta)
+
+    def _pop(self) -> Optional[Packet]:
+        """Remove the first packet and update the byte count (lock held)."""
+        packet = self.ring.pop()
+        if packet is not None:
+            self.bytes_out += packet.data_length
+        return packet
 
     def dequeue(self) -> Optional[Packet]:
         """Remove and return the first packet from the queue."""
         with self.lock:
-            return self.items.pop(0) if not self.is_empty() else None
+            return self._pop()
 
     def get(self) -> Optional[Packet]:
-        """Get the next packet, waiting if the queue is empty."""
+        """Take the next packet into service, waiting if the queue is empty; None once the stream has ended."""
+        while True:
+            with self.lock:
+                if not self.is_empty():
+                    packet = self._pop()
+                    self.serving[threading.get_ident()] = packet
+                    return packet
+                if self.ring.closed:
+                    return None
+            self.ring.wait()
+
+    def finish(self, on_finished: Optional[Callable[[Packet], None]] = None, processed: bool = False) -> None:
+        """End the service of the packet the calling thread took with `get`.
+
+        `on_finished` records the packet, and `processed` counts it in
+        `total_processed`, in the same step under `lock`, so a checkpoint sees
+        it either in service or fully recorded.
+        """
         with self.lock:
-            while self.is_empty():
-                self.condition.wait()
-            return self.items.pop(0)
+            packet = self.serving.pop(threading.get_ident(), None)
+            if packet is None:
+                return
+            if processed:
+                self.counters.add('total_processed')
+            if on_finished is not None:
+                on_finished(packet)
+
+    def put_back(self, packet: Packet) -> bool:
+        """End the service of a packet taken with `get` and enqueue it again, in one step for checkpoints."""
+        with self.lock:
+            self.serving.pop(threading.get_ident(), None)
+            return self.enqueue(packet)
 
-    def process_packets(self, sim_start_time: float) -> tuple[Optional[Packet], str]:
-        """Process the next packet in the queue."""
-        if self.is_empty():
-            return None, ""
+    def process_packets(self, sim_start_time: float,
+                        on_processed: Optional[Callable[[Packet], None]] = None) -> tuple[Optional[Packet], str]:
+        """Process the next packet in the queue.
 
-        current_packet = self.items[0]
+        The packet is removed, counted and passed to `on_processed` in one step
+        under `lock`, so a checkpoint sees it either waiting or fully recorded.
+        """
+        current_packet = self.ring.peek()
         if current_packet is None:
-            return self.dequeue(), ""
+            return None, ""
 
         current_time = time.time() - sim_start_time
         time_to_process = current_packet.data_length / self.processing_speed
@@ -134,91 +250,117 @@ class PacketQueue:
         time.sleep(time_to_process)
 
         current_packet.completion_time = time.time() - sim_start_time
-        self.stats['total_processing_time'] += time_to_process
-        self.stats['total_processed'] += 1
-
-        return self.dequeue(), ""
+        with self.lock:
+            packet = self._pop()
+            self.counters.add('total_processing_time', time_to_process)
+            self.counters.add('total_processed')
+            if on_processed is not None:
+                on_processed(packet)
+        return packet, ""
 
 class StatisticsCollector:
-    """Collects and plots simulation statistics over time."""
+    """Collects and plots simulation statistics over time in constant memory."""
     
-    def __init__(self):
-        self.timestamps = []
-        self.throughput = []  # packets processed per second
-        self.queue_size = []
-        self.processing_times = []
-        self.transmission_times = []
-        self.dropped_packets = []
+    def __init__(self, resolution: float = 0.1, throughput_window: float = 1.0):
+        # Fixed-size min/max/mean rollups, whatever the length of the run
+        self.throughput = RollupSeries(resolution)  # packets processed per second
+        self.queue_size = RollupSeries(resolution)
+        self.processing_times = RollupSeries(resolution)
+        self.transmission_times = RollupSeries(resolution)
+        self.dropped_packets = RollupSeries(resolution)
+        self.processed_rate = SlidingWindowRate(throughput_window)
+        self.last_processed = 0
+        self.max_plot_points = 1000
         self.lock = threading.Lock()
 
     def record_statistics(self, current_time: float, queue: 'PacketQueue') -> None:
         """Record statistics at the current time."""
         with self.lock:
-            self.timestamps.append(current_time)
-            # Calculate throughput (packets processed per second)
-            if len(self.timestamps) > 1:
-                time_diff = current_time - self.timestamps[-2]
-                throughput = queue.stats['total_processed'] / current_time if current_time > 0 else 0
-            else:
-                throughput = 0
-            self.throughput.append(throughput)
-            self.queue_size.append(len(queue.items))
-            self.processing_times.append(queue.stats['total_processing_time'])
-            self.transmission_times.append(queue.stats['total_transmission_time'])
-            self.dropped_packets.append(queue.stats['total_dropped'])
-
-    def plot_statistics(self) -> None:
-        """Plot the collected statistics."""
-        plt.figure(figsize=(10, 20))  # Adjusted figure size for vertical layout
-        
-        # Plot 1: Throughput over time
-        plt.subplot(4, 1, 1)
-        plt.plot(self.timestamps, self.throughput, 'b-', label='Throughput (packets/s)')
-        plt.xlabel('Simulation Time (s)', fontsize=6)
-        plt.ylabel('Throughput', fontsize=6)
-        plt.grid(True)
-        plt.legend()
-
-        # Plot 2: Queue Size over time
-        plt.subplot(4, 1, 2)
-        plt.plot(self.timestamps, self.queue_size, 'r-', label='Queue Size (packets)')
+            processed = queue.stats['total_processed']
+            self.processed_rate.add(current_time, processed - self.last_processed)
+            self.last_processed = processed
+            self.throughput.add(current_time, self.processed_rate.rate(current_time))
+            self.queue_size.add(current_time, len(queue.items))
+            self.processing_times.add(current_time, queue.stats['total_processing_time'])
+            self.transmission_times.add(current_time, queue.stats['total_transmission_time'])
+            self.dropped_packets.add(current_time, queue.stats['total_dropped'])
+
+    def _plot_series(self, position: int, series: RollupSeries, style: str, label: str, ylabel: str) -> None:
+        """Plot one downsampled series with its per-bucket min/max envelope."""
+        points = series.downsample(self.max_plot_points)
+        plt.subplot(4, 1, position)
+        plt.fill_between(points['time'], points['min'], points['max'], color=style[0], alpha=0.2)
+        plt.plot(points['time'], points['mean'], style, label=label)
         plt.xlabel('Simulation Time (s)', fontsize=6)
-        plt.ylabel('Queue Size', fontsize=6)
+        plt.ylabel(ylabel, fontsize=6)
         plt.grid(True)
         plt.legend()
 
-        # Plot 3: Processing Time over time
-        plt.subplot(4, 1, 3)
-        plt.plot(self.timestamps, self.processing_times, 'g-', label='Processing Time (s)')
-        plt.xlabel('Simulation Time (s)', fontsize=6)
-        plt.ylabel('Processing Time (s)', fontsize=6)
-        plt.grid(True)
-        plt.legend()
-
-        # Plot 4: Dropped Packets over time
-        plt.subplot(4, 1, 4)
-        plt.plot(self.timestamps, self.dropped_packets, 'm-', label='Dropped Packets (count)')
-        plt.xlabel('Simulation Time (s)', fontsize=6)
-        plt.ylabel('Dropped Packets', fontsize=6)
-        plt.grid(True)
-        plt.legend()
+    def plot_statistics(self) -> None:
+        """Plot the collected statistics."""
+        plt.figure(figsize=(10, 20))  # Adjusted figure size for vertical layout
+        self._plot_series(1, self.throughput, 'b-', 'Throughput (packets/s)', 'Throughput')
+        self._plot_series(2, self.queue_size, 'r-', 'Queue Size (packets)', 'Queue Size')
+        self._plot_series(3, self.processing_times, 'g-', 'Processing Time (s)', 'Processing Time (s)')
+        self._plot_series(4, self.dropped_packets, 'm-', 'Dropped Packets (count)', 'Dropped Packets')
         plt.tight_layout(h_pad=6)
         plt.show()
 
 class Simulation:
     """Main simulation class that coordinates the entire process."""
     
-    def __init__(self, queue_capacity: int, network_speed: int, generation_speed: float = 0.05, csv_file: str = "packets.csv"):
+    def __init__(self, queue_capacity: int, network_speed: int, generation_speed: float = 0.05, csv_file: str = "packets.csv",
+                 trace: Optional[Iterable[Dict]] = None, replay_timing: bool = False,
+                 service_rates: Optional[List[int]] = None, dispatch_policy: str = 'shared',
+                 target_precision: Optional[float] = None, confidence: float = 0.95,
+                 metrics_port: Optional[int] = None, checkpoint_interval: Optional[float] = None,
+                 checkpoint_path: str = "fifo_checkpoint.ckpt", quiet: bool = False):
+        # Constructor arguments, stored in checkpoints to rebuild the simulation
+        self.config = {name: value for name, value in locals().items() if name not in ('self', 'trace')}
         self.sim_start_time = time.time()
-        self.event_logger = EventLogger(self.sim_start_time)
-        self.packet_queue = PacketQueue(queue_capacity)
+        self.event_logger = EventLogger(self.sim_start_time, quiet)
+        self.quiet = quiet  # No console/file log and no plots
+        self.service_pool = None
+        if service_rates:
+            # Several service units with independent rates (bytes/s); the pool
+            # stands in for the single queue as seen by the generator and stats
+            self.service_pool = ServicePool(PacketQueue, lambda: NetworkLink(network_speed),
+                                            service_rates, queue_capacity, dispatch_policy)
+            self.packet_queue = self.service_pool
+        else:
+            self.packet_queue = PacketQueue(queue_capacity)
         self.network_link = NetworkLink(network_speed)
         self.generation_speed = generation_speed  # Time between packet generation in seconds
         self.csv_file = csv_file
-        self.packets_data = self._load_packets_from_csv()
+        # A TraceReader/StitchedTrace is streamed instead of loading csv_file
+        self.trace = trace
+        self.packets_data = trace if trace is not None else self._load_packets_from_csv()
+        self.trace_position = None  # Next trace row after the last generated packet
+        self.replay_timing = replay_timing  # Follow trace inter-arrival times instead of generation_speed
         self.stats_collector = StatisticsCollector()
         self.stats_interval = 0.1  # Collect stats every 0.1 seconds
+        # Online batch-means estimators with MSER warm-up removal
+        self.delay_estimator = BatchMeansEstimator(confidence=confidence)
+        self.drop_estimator = BatchMeansEstimator(confidence=confidence)
+        self.target_precision = target_precision  # Relative CI half-width that ends the run early
+        self.precision_check_interval = 100  # Packets between precision checks
+        self.stop_requested = threading.Event()
+        # Optional Prometheus endpoint fed with snapshots from the stats thread
+        self.metrics_exporter = MetricsExporter(metrics_port) if metrics_port is not None else None
+        self.delay_histogram = DelayHistogram()
+        # Offered and delivered volume, for goodput
+        self.traffic = ThreadCounters({'offered_bytes': 0, 'delivered_packets': 0, 'delivered_bytes': 0})
+        self.event_rate = SlidingWindowRate(window=1.0)
+        self.last_event_count = 0
+        # Periodic snapshots; checkpoint_lock keeps packet generation on a packet boundary
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_lock = threading.Lock()
+        self.checkpoint_thread: Optional[threading.Thread] = None
+        self.generation_complete = threading.Event()
         self.simulation_complete = threading.Event()
+        self.interrupted = threading.Event()  # Ctrl-C: workers stop after the packet in service
+        self.workers: List[threading.Thread] = []
 
     def _load_packets_from_csv(self) -> List[Dict[str, int]]:
         """Load packet data from CSV file."""
@@ -240,51 +382,113 @@ class Simulation:
         while not self.simulation_complete.is_set():
             current_time = time.time() - self.sim_start_time
             self.stats_collector.record_statistics(current_time, self.packet_queue)
+            if self.metrics_exporter is not None:
+                self.metrics_exporter.publish(self._metrics_snapshot(current_time))
             time.sleep(self.stats_interval)
 
+    def _drops_by_cause(self) -> Dict[str, int]:
+        """Return early (AQM) and overflow drop counts."""
+        if self.service_pool is not None:
+            return self.service_pool.drops_by_cause()
+        return {'early': self.packet_queue.stats['early_drops'],
+                'overflow': self.packet_queue.stats['overflow_drops']}
+
+    def _metrics_snapshot(self, current_time: float) -> list:
+        """Build the exported metrics from plain reads of the counters, without the queue lock."""
+        queue = self.packet_queue
+        events = self.event_logger.event_count
+        self.event_rate.add(current_time, events - self.last_event_count)
+        self.last_event_count = events
+        labels = {'queue': 'fifo'}
+        delays = self.delay_histogram.quantiles([0.5, 0.9, 0.99])
+        return [
+            ('aqm_sim_packets_in_total', 'counter', 'Packets offered to the queue.',
+             [(labels, queue.stats['total_packets'])]),
+            ('aqm_sim_packets_out_total', 'counter', 'Packets fully processed.',
+             [(labels, queue.stats['total_processed'])]),
+            ('aqm_sim_drops_total', 'counter', 'Dropped packets by cause.',
+             [(dict(labels, cause=cause), count) for cause, count in self._drops_by_cause().items()]),
+            ('aqm_sim_queue_length_packets', 'gauge', 'Packets waiting in the queue.',
+             [(labels, len(queue.items))]),
+            ('aqm_sim_queue_length_bytes', 'gauge', 'Bytes waiting in the queue.',
+             [(labels, queue.queued_bytes)]),
+            ('aqm_sim_drop_probability', 'gauge', 'Current AQM drop probability.',
+             [(labels, getattr(queue, 'drop_probability', 0.0))]),
+            ('aqm_sim_packet_delay_seconds', 'summary', 'Packet delay from creation to completion.',
+             [(dict(labels, quantile=str(q)), value) for q, value in delays.items()] +
+             [(dict(labels, __name__='aqm_sim_packet_delay_seconds_sum'), self.delay_histogram.total),
+              (dict(labels, __name__='aqm_sim_packet_delay_seconds_count'), self.delay_histogram.count)]),
+            ('aqm_sim_engine_events_per_second', 'gauge', 'Logged simulation events per second.',
+             [(labels, self.event_rate.rate(current_time))]),
+        ]
+
     def generate_packets(self) -> None:
         """Generate packets with specified intervals."""
         self.event_logger.log_event("=== Starting Packet Generation ===")
-        self.packet_queue.stats['total_packets'] = len(self.packets_data)
-
-        for packet_data in self.packets_data:
-            packet = Packet(
-                packet_id=packet_data['packet_id'],
-                data_length=packet_data['data_length'],
-                creation_time=time.time() - self.sim_start_time
-            )
-            self.event_logger.log_event(f"Generated {packet}")
-            
-            if not self.packet_queue.enqueue(packet):
-                self.event_logger.log_event(f"Queue full - {packet} dropped")
-            
-            time.sleep(self.generation_speed)  # Use the configurable generation speed
+        replay_origin = None  # Wall-clock time of trace time 0
 
-        self.event_logger.log_event("=== Packet Generation Complete ===")
-        self.packet_queue.enqueue(None)  # Signal end of processing
+        try:
+            for packet_data in self.packets_data:
+                if self.stop_requested.is_set():
+                    break
+                if self.replay_timing and 'time' in packet_data:
+                    # Schedule against a fixed origin so per-packet overhead does not stretch bursts
+                    if replay_origin is None:
+                        replay_origin = time.time() - packet_data['time']
+                    time.sleep(max(replay_origin + packet_data['time'] - time.time(), 0))
+
+                with self.checkpoint_lock:
+                    packet = Packet(
+                        packet_id=packet_data['packet_id'],
+                        data_length=packet_data['data_length'],
+                        creation_time=time.time() - self.sim_start_time,
+                        flow=packet_data.get('flow')
+                    )
+                    self.packet_queue.add_stat('total_packets')
+                    self.traffic.add('offered_bytes', packet.data_length)
+                    self.event_logger.log_event(f"Generated {packet}")
+
+                    accepted = self.packet_queue.enqueue(packet)
+                    self.drop_estimator.add(0.0 if accepted else 1.0)
+                    self.trace_position = getattr(self.packets_data, 'position', None)
+                if not accepted:
+                    self.event_logger.log_event(f"Queue full - {packet} dropped")
+            
+                if not (self.replay_timing and 'time' in packet_data):
+                    time.sleep(self.generation_speed)  # Use the configurable generation speed
+        finally:
+            # Always end the stream, or the processor would wait in get() forever
+            self.generation_complete.set()
+            self.event_logger.log_event("=== Packet Generation Complete ===")
+            self.packet_queue.enqueue(None)  # Signal end of processing
 
     def process_packets(self) -> None:
         """Process packets from the queue."""
+        if self.service_pool is not None:
+            self._process_with_pool()
+            return
+
         self.event_logger.log_event("=== Starting Packet Processing ===")
 
-        while True:
+        while not self.interrupted.is_set():
             packet = self.packet_queue.get()
             if packet is None:
                 break
 
             transmission_time = self.network_link.transmit_packet(packet, self.sim_start_time)
-            self.packet_queue.stats['total_transmission_time'] += transmission_time
+            self.packet_queue.add_stat('total_transmission_time', transmission_time)
 
-            if self.packet_queue.enqueue(packet):
+            if self.packet_queue.put_back(packet):
                 self.event_logger.log_event(f"{packet} enqueued for processing")
             else:
                 self.event_logger.log_event(f"Queue full - {packet} dropped")
 
             if not self.packet_queue.is_empty():
-                processed_packet, _ = self.packet_queue.process_packets(self.sim_start_time)
+                processed_packet, _ = self.packet_queue.process_packets(self.sim_start_time, self._record_delay)
                 if processed_packet:
                     self.event_logger.log_event(f"{processed_packet} dequeued")
-                    if self.packet_queue.stats['total_processed'] == len(self.packets_data):
+                    if (self.generation_complete.is_set() and
+                            self.packet_queue.stats['total_processed'] == self.packet_queue.stats['total_packets']):
                         self._print_statistics()
                         self.event_logger.log_event("=== All packets processed - Exiting ===")
                         self.simulation_complete.set()
@@ -294,9 +498,44 @@ class Simulation:
         self.event_logger.log_event("=== All packets processed - Exiting ===")
         self.simulation_complete.set()
 
+    def _process_with_pool(self) -> None:
+        """Process packets with every unit of the service pool in parallel."""
+        self.event_logger.log_event(
+            f"=== Starting Packet Processing ({len(self.service_pool.units)} units, "
+            f"{self.service_pool.policy} dispatch) ===")
+        self.service_pool.run(self.sim_start_time, self._on_unit_served, self.interrupted)
+        self._print_statistics()
+        self.event_logger.log_event("=== All packets processed - Exiting ===")
+        self.simulation_complete.set()
+
+    def _on_unit_served(self, packet: Packet, unit: ServiceUnit) -> None:
+        """Log and record a packet served by one unit of the service pool."""
+        self.event_logger.log_event(f"{packet} dequeued by unit {unit.unit_id}")
+        self._record_delay(packet)
+
+    def _record_delay(self, packet: Packet) -> None:
+        """Feed the delay estimator and stop generation once the requested precision is reached."""
+        delay = packet.completion_time - packet.creation_time
+        self.traffic.add('delivered_packets')
+        self.traffic.add('delivered_bytes', packet.data_length)
+        self.delay_estimator.add(delay)
+        self.delay_histogram.add(delay)
+        if (self.target_precision is None or self.stop_requested.is_set()
+                or self.delay_estimator.count % self.precision_check_interval != 0):
+            return
+        if (self.delay_estimator.precision_reached(self.target_precision) and
+                self.drop_estimator.precision_reached(self.target_precision)):
+            self.stop_requested.set()
+            self.event_logger.log_event(
+                f"=== Requested precision reached after {self.delay_estimator.count} packets - "
+                f"stopping generation ===")
+
     def _print_statistics(self) -> None:
         """Print simulation statistics."""
         total_time = time.time() - self.sim_start_time
+        delay = self.delay_estimator.result()
+        drops = self.drop_estimator.result()
+        confidence = f"{self.delay_estimator.confidence:.0%} CI"
         stats = [
             "\n=== Simulation Statistics ===",
             f"Total Simulation Time: {total_time:.2f}s",
@@ -304,9 +543,22 @@ class Simulation:
             f"Total Packets Processed: {self.packet_queue.stats['total_processed']}",
             f"Total Packets Dropped: {self.packet_queue.stats['total_dropped']}",
             f"Average Processing Time: {self._calculate_avg_processing_time():.2f}s",
+            f"Goodput: {self.traffic.snapshot()['delivered_bytes'] / total_time:.0f} B/s",
+            f"Steady-State Packet Delay: {delay['mean']:.4f}s ± {delay['half_width']:.4f}s "
+            f"({confidence}, {delay['warmup_samples']} warm-up samples removed)",
+            f"Steady-State Drop Rate: {drops['mean']:.4f} ± {drops['half_width']:.4f} "
+            f"({confidence}, {drops['warmup_samples']} warm-up samples removed)",
             f"Queue Capacity: {self.packet_queue.capacity}",
             "===========================\n"
         ]
+        if self.service_pool is not None:
+            pool_stats = self.service_pool.stats
+            avg_delay = (pool_stats['total_queue_delay'] / pool_stats['queue_delay_count']
+                         if pool_stats['queue_delay_count'] else 0.0)
+            stats.insert(-1, f"Average Queue Delay: {avg_delay:.2f}s")
+            for unit in self.service_pool.unit_summary():
+                stats.insert(-1, f"Unit {unit['unit']} ({unit['rate']} B/s): "
+                                 f"{unit['processed']} processed, busy {unit['busy_time']:.2f}s")
         self.event_logger.log_event("\n".join(stats))
 
     def _calculate_avg_processing_time(self) -> float:
@@ -316,37 +568,93 @@ class Simulation:
                    self.packet_queue.stats['total_processed'])
         return 0.0
 
+    def save_checkpoint(self, path: Optional[str] = None) -> str:
+        """Write a snapshot of the running simulation and return its path."""
+        path = path or self.checkpoint_path
+        checkpoint.save_snapshot(path, checkpoint.capture_simulation(self))
+        self.event_logger.log_event(f"Checkpoint saved to {path}")
+        return path
+
+    @classmethod
+    def from_checkpoint(cls, path: str, trace: Optional[Iterable[Dict]] = None, **overrides) -> 'Simulation':
+        """Rebuild a simulation from a snapshot; `overrides` change constructor arguments for a what-if fork."""
+        state = checkpoint.load_snapshot(path)
+        config = dict(state['config'], **overrides)
+        simulation = cls(trace=trace if trace is not None else state['trace'], **config)
+        checkpoint.restore_simulation(simulation, state)
+        simulation.event_logger.log_event(f"=== Resumed from checkpoint {path} ===")
+        return simulation
+
+    def _checkpoint_periodically(self) -> None:
+        """Save a checkpoint every `checkpoint_interval` seconds until the run ends."""
+        while not self.simulation_complete.wait(self.checkpoint_interval):
+            self.save_checkpoint()
+
+    def _shut_down(self) -> None:
+        """Stop generation and processing after an interrupt and wait for every thread that writes state."""
+        self.interrupted.set()
+        self.stop_requested.set()
+        self.packet_queue.enqueue(None)
+        self.simulation_complete.set()  # Also ends the periodic checkpoints
+        for thread in self.workers + [self.checkpoint_thread]:
+            if thread is not None:
+                thread.join()
+
     def run(self) -> None:
         """Run the simulation with proper thread management."""
         try:
+            if self.metrics_exporter is not None:
+                self.metrics_exporter.start()
+                self.event_logger.log_event(
+                    f"Metrics available at http://{self.metrics_exporter.host}:{self.metrics_exporter.port}/metrics")
+
             # Start statistics collection thread
             stats_thread = threading.Thread(target=self._collect_statistics, daemon=True)
             stats_thread.start()
 
+            if self.checkpoint_interval:
+                self.checkpoint_thread = threading.Thread(target=self._checkpoint_periodically, daemon=True)
+                self.checkpoint_thread.start()
+
             generator_thread = threading.Thread(target=self.generate_packets)
             processor_thread = threading.Thread(target=self.process_packets)
 
             generator_thread.start()
             processor_thread.start()
+            self.workers = [generator_thread, processor_thread]
 
             generator_thread.join()
             processor_thread.join()
 
+            if self.metrics_exporter is not None:
+                self.metrics_exporter.publish(self._metrics_snapshot(time.time() - self.sim_start_time))
+                self.metrics_exporter.stop()
+
             # Wait for stats collection to complete
             self.simulation_complete.wait()
             
             # Plot statistics in the main thread
-            self.stats_collector.plot_statistics()
+            if not self.quiet:
+                self.stats_collector.plot_statistics()
 
         except KeyboardInterrupt:
             print("\nSimulation interrupted by user")
+            self._shut_down()
+            print(f"Checkpoint saved to {self.save_checkpoint()}")
             sys.exit(1)
         except Exception as e:
             print(f"\nError in simulation: {str(e)}")
             sys.exit(1)
 
 def main():
-    """Main entry point of the simulation."""
+    """Main entry point of the simulation; `--resume <checkpoint>` continues an interrupted run."""
+    parser = argparse.ArgumentParser(description="FIFO queue simulation")
+    parser.add_argument('--resume', metavar='CHECKPOINT', help="Continue from a checkpoint, e.g. the one saved on Ctrl-C")
+    args = parser.parse_args()
+    if args.resume:
+        Simulation.from_checkpoint(args.resume).run()
+        return
+
     simulation = Simulation(
         queue_capacity=500,  #  queue capacity (packets)
         network_speed=100000,   # Increased to 100mbps
@@ -356,4 +664,6 @@ def main():
     simulation.run()
 
 if __name__ == "__main__":
-    main()
+    # Run from the imported module so checkpoints pickle main.Packet rather than __main__.Packet
+    import main
+    main.main()
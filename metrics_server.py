@@ -0,0 +1,118 @@
+import math
+import threading
+from array import array
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional, List, Dict, Tuple
+
+# (name, type, help, [(labels, value), ...]); a '__name__' label renames one sample (e.g. '<name>_sum')
+Metric = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+class DelayHistogram:
+    """Log-spaced delay histogram shared by every thread that completes packets."""
+
+    def __init__(self, min_delay: float = 1e-4, max_delay: float = 100.0, buckets_per_decade: int = 20):
+        self.min_delay = min_delay
+        self.buckets_per_decade = buckets_per_decade
+        size = int(math.ceil(math.log10(max_delay / min_delay) * buckets_per_decade)) + 2
+        self.counts = array('q', [0] * size)
+        self.total = 0.0  # Sum of all delays, exported as the summary _sum
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def _upper_bound(self, i: int) -> float:
+        """Upper edge of bucket i in seconds."""
+        return self.min_delay * 10 ** (i / self.buckets_per_decade)
+
+    def add(self, delay: float) -> None:
+        """Count one delay sample."""
+        if delay <= self.min_delay:
+            i = 0
+        else:
+            i = min(int(math.log10(delay / self.min_delay) * self.buckets_per_decade) + 1,
+                    len(self.counts) - 1)
+        with self.lock:  # Pool units record concurrently
+            self.counts[i] += 1
+            self.total += delay
+            self.count += 1
+
+    def quantiles(self, probabilities: List[float]) -> Dict[float, float]:
+        """Return the bucket upper edge reached by each quantile."""
+        with self.lock:
+            counts = self.counts[:]
+        total = sum(counts)
+        result = {}
+        for p in probabilities:
+            if total == 0:
+                result[p] = 0.0
+                continue
+            target = p * total
+            running = 0
+            for i, count in enumerate(counts):
+                running += count
+                if running >= target:
+                    result[p] = self._upper_bound(i)
+                    break
+        return result
+
+class MetricsExporter:
+    """Serves the latest published snapshot in Prometheus text format from a background thread.
+
+    The simulation calls `publish` with a freshly built list of metrics; the
+    HTTP thread only ever reads the current reference, so scrapes never touch
+    the queue or its lock.
+    """
+
+    def __init__(self, port: int = 9100, host: str = '127.0.0.1'):
+        self.host = host
+        self.port = port
+        self._snapshot: List[Metric] = []
+        self.server: Optional[ThreadingHTTPServer] = None
+        self.thread: Optional[threading.Thread] = None
+
+    def publish(self, snapshot: List[Metric]) -> None:
+        """Replace the snapshot served to scrapers."""
+        self._snapshot = snapshot
+
+    @staticmethod
+    def render(snapshot: List[Metric]) -> str:
+        """Format a snapshot as Prometheus exposition text."""
+        lines = []
+        for name, metric_type, help_text, samples in snapshot:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                sample_name = labels.get('__name__', name)
+                label_text = ','.join(f'{key}="{val}"' for key, val in labels.items() if key != '__name__')
+                lines.append(f"{sample_name}{{{label_text}}} {value}" if label_text else f"{sample_name} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def start(self) -> None:
+        """Start serving /metrics on a daemon thread."""
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = exporter.render(exporter._snapshot).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Keep scrapes out of the simulation console output
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stop the HTTP server."""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
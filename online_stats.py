@@ -0,0 +1,141 @@
+import math
+import threading
+from array import array
+from statistics import NormalDist
+from typing import Dict, List, Sequence
+
+def t_quantile(p: float, df: int) -> float:
+    """Student-t quantile from the Cornish-Fisher expansion around the normal quantile."""
+    z = NormalDist().inv_cdf(p)
+    if df <= 0:
+        return float('inf')
+    return (z
+            + (z ** 3 + z) / (4 * df)
+            + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+            + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3))
+
+class BatchMeansEstimator:
+    """Online mean estimator with MSER-5 warm-up truncation and batch-means confidence interval.
+
+    Observations are folded into mini-batches of `mini_batch` samples as they
+    arrive, so only one float per mini-batch is kept. On request the warm-up
+    prefix is removed with MSER (the truncation point minimising the standard
+    error of the remaining mini-batch means, searched over the first half of
+    the run) and the remainder is regrouped into `num_batches` batches whose
+    means give a t-based confidence interval.
+
+    The interval is only trusted by `precision_reached` once the batch means
+    look independent: the remainder is also split into twice as many
+    half-size batches, and their lag-1 autocorrelation must be at most
+    `max_lag1` (0 by default: independent batch means pass about half the
+    checks). Batches grow with the run, so strongly autocorrelated series
+    such as queueing delay simply need longer runs. `min_samples` and
+    `min_batch_size` (observations after warm-up, and per batch) keep the
+    test from being decided on a handful of values.
+    """
+
+    def __init__(self, mini_batch: int = 5, num_batches: int = 20, confidence: float = 0.95,
+                 min_samples: int = 1000, min_batch_size: int = 50, max_lag1: float = 0.0):
+        self.mini_batch = mini_batch
+        self.num_batches = num_batches
+        self.confidence = confidence
+        self.min_samples = min_samples
+        self.min_batch_size = min_batch_size
+        self.max_lag1 = max_lag1
+        self.means = array('d')  # One entry per completed mini-batch
+        self.count = 0
+        self._partial_sum = 0.0
+        self._partial_count = 0
+        self.lock = threading.Lock()
+
+    def add(self, value: float) -> None:
+        """Record one observation."""
+        with self.lock:
+            self.count += 1
+            self._partial_sum += value
+            self._partial_count += 1
+            if self._partial_count == self.mini_batch:
+                self.means.append(self._partial_sum / self.mini_batch)
+                self._partial_sum = 0.0
+                self._partial_count = 0
+
+    def _mser_truncation(self) -> int:
+        """Return the number of leading mini-batches to discard as warm-up."""
+        m = len(self.means)
+        if m < 4:
+            return 0
+        # Suffix sums give every candidate's mean and spread in one pass
+        suffix_sum = [0.0] * (m + 1)
+        suffix_sq = [0.0] * (m + 1)
+        for i in range(m - 1, -1, -1):
+            suffix_sum[i] = suffix_sum[i + 1] + self.means[i]
+            suffix_sq[i] = suffix_sq[i + 1] + self.means[i] ** 2
+        best_d, best_value = 0, float('inf')
+        for d in range(m // 2 + 1):
+            n = m - d
+            squared_error = suffix_sq[d] - suffix_sum[d] ** 2 / n
+            value = squared_error / (n * n)
+            if value < best_value:
+                best_d, best_value = d, value
+        return best_d
+
+    @staticmethod
+    def _batch_means(values: Sequence[float], batches: int) -> List[float]:
+        """Means of `batches` equal batches, dropping the oldest remainder."""
+        size = len(values) // batches
+        values = values[len(values) - size * batches:]
+        return [sum(values[i * size:(i + 1) * size]) / size for i in range(batches)]
+
+    @staticmethod
+    def _lag1_autocorrelation(values: Sequence[float]) -> float:
+        """Lag-1 sample autocorrelation; 0 for a constant series."""
+        mean = sum(values) / len(values)
+        variance = sum((v - mean) ** 2 for v in values)
+        if variance == 0:
+            return 0.0
+        covariance = sum((values[i] - mean) * (values[i + 1] - mean) for i in range(len(values) - 1))
+        return covariance / variance
+
+    def result(self) -> Dict[str, float]:
+        """Return mean, confidence half-width, relative precision and batch independence after warm-up removal."""
+        with self.lock:
+            truncated = self._mser_truncation()
+            steady = self.means[truncated:]
+        batches = self.num_batches if len(steady) >= self.num_batches else len(steady)
+        result = {
+            'mean': 0.0,
+            'half_width': float('inf'),
+            'relative_precision': float('inf'),
+            'warmup_samples': truncated * self.mini_batch,
+            'samples': len(steady) * self.mini_batch,
+            'batches': batches,
+            'batch_size': 0,
+            'lag1_autocorrelation': math.nan
+        }
+        if not steady:
+            return result
+        batch_means = self._batch_means(steady, batches)
+        mean = sum(batch_means) / batches
+        result['batch_size'] = len(steady) // batches * self.mini_batch
+        if len(steady) >= 2 * batches >= 4:
+            result['lag1_autocorrelation'] = self._lag1_autocorrelation(self._batch_means(steady, 2 * batches))
+        result['mean'] = mean
+        if batches < 2:
+            return result
+        variance = sum((b - mean) ** 2 for b in batch_means) / (batches - 1)
+        half_width = t_quantile(0.5 + self.confidence / 2, batches - 1) * math.sqrt(variance / batches)
+        result['half_width'] = half_width
+        if mean != 0:
+            result['relative_precision'] = half_width / abs(mean)
+        elif half_width == 0:
+            result['relative_precision'] = 0.0
+        return result
+
+    def precision_reached(self, target: float) -> bool:
+        """Check whether the relative CI half-width is within `target` from large, independent batches."""
+        result = self.result()
+        return (result['batches'] >= self.num_batches
+                and result['samples'] >= self.min_samples
+                and result['batch_size'] >= self.min_batch_size
+                and result['lag1_autocorrelation'] <= self.max_lag1
+                and result['relative_precision'] <= target)
@@ -0,0 +1,251 @@
+import sys
+import math
+import time
+import random
+import argparse
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List, Dict, Tuple, Callable
+
+# name -> (low, high, scale); 'log' samples uniformly in log space
+SearchSpace = Dict[str, Tuple[float, float, str]]
+
+DEFAULT_SPACES: Dict[str, SearchSpace] = {
+    'pie': {
+        'alpha': (0.001, 0.5, 'log'),
+        'beta': (0.005, 5.0, 'log'),
+        'target_delay': (0.005, 0.2, 'log'),
+        'activation_threshold': (0.0, 0.9, 'linear')
+    },
+    'red': {
+        'max_p': (0.01, 0.5, 'log'),
+        'weight': (0.0005, 0.05, 'log')
+    },
+    'ared': {
+        'weight': (0.0005, 0.05, 'log')
+    },
+    'codel': {
+        'target': (0.001, 0.05, 'log'),
+        'interval': (0.02, 0.5, 'log')
+    },
+    'dualpi2': {
+        # Gains in Hz (scaled by update_interval in the queue), around the RFC 9332 0.16/3.2
+        'target': (0.005, 0.05, 'log'),
+        'alpha': (0.02, 1.5, 'log'),
+        'beta': (0.3, 30.0, 'log')
+    }
+}
+
+def sample_params(space: SearchSpace, rng: random.Random) -> Dict[str, float]:
+    """Draw one configuration from the search space."""
+    params = {}
+    for name, (low, high, scale) in space.items():
+        if scale == 'log':
+            params[name] = math.exp(rng.uniform(math.log(low), math.log(high)))
+        else:
+            params[name] = rng.uniform(low, high)
+    return params
+
+class Objective:
+    """Trial score to minimise: one delay metric, with goodput and drop-rate constraints.
+
+    `min_goodput` is an absolute floor in bytes/s; `min_delivery_ratio` is the
+    share of offered bytes that must be delivered, which compares fairly
+    across prefixes of different lengths.
+
+    A trial that misses a constraint scores above every feasible one, ranked
+    by how far it misses, so a rung with no feasible trial still keeps the
+    closest ones. Failed trials and trials that delivered nothing score inf.
+    """
+
+    PENALTY = 1e6
+
+    def __init__(self, metric: str = 'p99_delay', min_goodput: Optional[float] = None,
+                 min_delivery_ratio: Optional[float] = None, max_drop_rate: Optional[float] = None):
+        self.metric = metric
+        self.min_goodput = min_goodput  # bytes per second
+        self.min_delivery_ratio = min_delivery_ratio
+        self.max_drop_rate = max_drop_rate
+
+    def __call__(self, metrics: Optional[Dict[str, float]]) -> float:
+        if not metrics or metrics['delivered'] == 0:
+            return math.inf
+        violation = 0.0
+        if self.min_goodput is not None and metrics['goodput'] < self.min_goodput:
+            violation += 1 - metrics['goodput'] / self.min_goodput
+        if self.min_delivery_ratio is not None and metrics['delivery_ratio'] < self.min_delivery_ratio:
+            violation += 1 - metrics['delivery_ratio'] / self.min_delivery_ratio
+        if self.max_drop_rate is not None and metrics['drop_rate'] > self.max_drop_rate:
+            violation += metrics['drop_rate'] - self.max_drop_rate
+        if violation > 0:
+            return self.PENALTY * (1 + violation)
+        return metrics[self.metric]
+
+class TraceTrial:
+    """Runs one quiet pie_main simulation on a prefix of an indexed trace.
+
+    Instances are picklable so trials can run in worker processes; the trace
+    index is opened in the worker.
+    """
+
+    def __init__(self, csv_file: str, aqm: str = 'pie', start: float = 0.0, **simulation_options):
+        self.csv_file = csv_file
+        self.aqm = aqm
+        self.start = start  # Offset of the prefix in the trace, in seconds
+        self.simulation_options = simulation_options
+
+    def __call__(self, params: Dict[str, float], duration: float) -> Optional[Dict[str, float]]:
+        """Replay `duration` seconds of the trace with the given AQM parameters."""
+        from pie_main import Simulation
+        from trace_index import TraceIndex, TraceReader
+
+        trace = TraceReader(TraceIndex.open(self.csv_file), self.start, self.start + duration)
+        options = dict({'queue_capacity': 100, 'network_speed': 1000000, 'replay_timing': True},
+                       **self.simulation_options)
+        simulation = Simulation(trace=trace, aqm=self.aqm, aqm_options=params, quiet=True, **options)
+        try:
+            simulation.run()
+        except SystemExit:  # run() exits on errors
+            return None
+        return trial_metrics(simulation)
+
+def trial_metrics(simulation) -> Dict[str, float]:
+    """Delay quantiles, drop rate and goodput of a finished simulation."""
+    elapsed = time.time() - simulation.sim_start_time
+    stats = simulation.packet_queue.stats
+    traffic = simulation.traffic.snapshot()
+    quantiles = simulation.delay_histogram.quantiles([0.5, 0.9, 0.99])
+    return {
+        'p50_delay': quantiles[0.5],
+        'p90_delay': quantiles[0.9],
+        'p99_delay': quantiles[0.99],
+        'mean_delay': simulation.delay_estimator.result()['mean'],
+        'drop_rate': stats['total_dropped'] / stats['total_packets'] if stats['total_packets'] else 0.0,
+        'goodput': traffic['delivered_bytes'] / elapsed if elapsed > 0 else 0.0,
+        'delivery_ratio': (traffic['delivered_bytes'] / traffic['offered_bytes']
+                           if traffic['offered_bytes'] else 0.0),
+        'delivered': traffic['delivered_packets']
+    }
+
+@dataclass
+class Trial:
+    """One configuration evaluated at one trace prefix length."""
+    params: Dict[str, float]
+    duration: float
+    score: float = math.inf
+    metrics: Dict[str, float] = field(default_factory=dict)
+
+class SuccessiveHalving:
+    """Successive-halving search over AQM parameters.
+
+    `num_configs` random configurations are first evaluated on a
+    `min_duration`-second trace prefix; after each rung only the best
+    1/`eta` are kept and the prefix grows by `eta`, up to `max_duration`.
+    Most of the budget therefore goes to the few configurations that keep
+    winning. Trials of a rung run in parallel in `workers` processes.
+    """
+
+    def __init__(self, evaluate: Callable[[Dict[str, float], float], Optional[Dict[str, float]]],
+                 space: SearchSpace, objective: Objective, num_configs: int = 27, eta: int = 3,
+                 min_duration: float = 2.0, max_duration: float = 18.0, workers: int = 4,
+                 seed: Optional[int] = None):
+        if eta < 2:
+            raise ValueError("eta must be at least 2")
+        self.evaluate = evaluate
+        self.space = space
+        self.objective = objective
+        self.num_configs = num_configs
+        self.eta = eta
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.workers = workers
+        self.rng = random.Random(seed)
+        self.history: List[Trial] = []
+
+    def rungs(self) -> List[Tuple[int, float]]:
+        """(configurations, prefix duration) of every rung."""
+        rungs = []
+        configs, duration = self.num_configs, self.min_duration
+        while True:
+            duration = min(duration, self.max_duration)
+            rungs.append((configs, duration))
+            if configs == 1 or duration >= self.max_duration:
+                return rungs
+            configs = max(configs // self.eta, 1)
+            duration *= self.eta
+
+    def _run_rung(self, executor: ProcessPoolExecutor, params_list: List[Dict[str, float]],
+                  duration: float) -> List[Trial]:
+        """Evaluate every configuration at one prefix length, best first."""
+        futures = [executor.submit(self.evaluate, params, duration) for params in params_list]
+        trials = []
+        for params, future in zip(params_list, futures):
+            metrics = future.result()
+            trial = Trial(params, duration, self.objective(metrics), metrics or {})
+            trials.append(trial)
+            self.history.append(trial)
+        return sorted(trials, key=lambda trial: trial.score)
+
+    def run(self, report: Optional[Callable[[int, List[Trial]], None]] = None) -> Trial:
+        """Run every rung and return the best trial at the longest prefix."""
+        candidates = [sample_params(self.space, self.rng) for _ in range(self.num_configs)]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for rung, (configs, duration) in enumerate(self.rungs()):
+                trials = self._run_rung(executor, candidates[:configs], duration)
+                if report is not None:
+                    report(rung, trials)
+                candidates = [trial.params for trial in trials]
+        return trials[0]
+
+def _format_trial(trial: Trial) -> str:
+    """One-line summary of a trial."""
+    params = ', '.join(f"{name}={value:.4g}" for name, value in trial.params.items())
+    metrics = trial.metrics
+    if not metrics:
+        return f"score=inf  {params}"
+    return (f"score={trial.score:.4g}  p99={metrics['p99_delay']:.4f}s  "
+            f"goodput={metrics['goodput']:.0f}B/s ({metrics['delivery_ratio']:.0%})  "
+            f"drops={metrics['drop_rate']:.3f}  {params}")
+
+def main():
+    """Tune AQM parameters on a trace: python optimizer.py <trace.csv> [options]."""
+    parser = argparse.ArgumentParser(description="Successive-halving search for AQM parameters")
+    parser.add_argument('csv_file', help="Trace CSV (indexed on first use)")
+    parser.add_argument('--aqm', default='pie', choices=sorted(DEFAULT_SPACES))
+    parser.add_argument('--metric', default='p99_delay',
+                        choices=['p50_delay', 'p90_delay', 'p99_delay', 'mean_delay'])
+    parser.add_argument('--min-goodput', type=float, help="Goodput floor in bytes/s")
+    parser.add_argument('--min-delivery-ratio', type=float, help="Share of offered bytes to deliver (0-1)")
+    parser.add_argument('--max-drop-rate', type=float, help="Drop-rate ceiling (0-1)")
+    parser.add_argument('--configs', type=int, default=27)
+    parser.add_argument('--eta', type=int, default=3)
+    parser.add_argument('--min-duration', type=float, default=2.0, help="First rung prefix in seconds")
+    parser.add_argument('--max-duration', type=float, default=18.0, help="Last rung prefix in seconds")
+    parser.add_argument('--start', type=float, default=0.0, help="Prefix offset in the trace, in seconds")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--queue-capacity', type=int, default=100)
+    parser.add_argument('--network-speed', type=int, default=1000000)
+    parser.add_argument('--service-rates', type=int, nargs='+', help="Serve with a pool of units (bytes/s each)")
+    parser.add_argument('--dispatch-policy', default='shared')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    evaluate = TraceTrial(args.csv_file, args.aqm, args.start,
+                          queue_capacity=args.queue_capacity, network_speed=args.network_speed,
+                          service_rates=args.service_rates, dispatch_policy=args.dispatch_policy)
+    search = SuccessiveHalving(evaluate, DEFAULT_SPACES[args.aqm],
+                               Objective(args.metric, args.min_goodput, args.min_delivery_ratio, args.max_drop_rate),
+                               args.configs, args.eta, args.min_duration, args.max_duration,
+                               args.workers, args.seed)
+
+    def report(rung: int, trials: List[Trial]) -> None:
+        print(f"Rung {rung}: {len(trials)} configurations on {trials[0].duration:.1f}s prefixes")
+        for trial in trials[:3]:
+            print(f"  {_format_trial(trial)}")
+        sys.stdout.flush()
+
+    best = search.run(report)
+    print(f"\nBest {args.aqm} parameters: {_format_trial(best)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import time
+import zlib
+import threading
+from typing import Optional, List, Dict, Callable, Any
+from handoff import ThreadCounters
+
+class ServiceUnit:
+    """One output server: processes a packet at its own rate, then sends it on its own link."""
+
+    def __init__(self, unit_id: int, queue: Any, processing_speed: int, link: Any):
+        self.unit_id = unit_id
+        self.queue = queue
+        self.processing_speed = processing_speed  # bytes per second
+        self.link = link
+        self.stats = {
+            'processed': 0,
+            'busy_time': 0.0
+        }
+
+    def serve(self, packet: Any, sim_start_time: float) -> tuple[float, float]:
+        """Serve one packet; return (processing_time, transmission_time)."""
+        packet.start_processing_time = time.time() - sim_start_time
+        time_to_process = packet.data_length / self.processing_speed
+        time.sleep(time_to_process)
+        packet.completion_time = time.time() - sim_start_time
+        transmission_time = self.link.transmit_packet(packet, sim_start_time)
+        self.stats['processed'] += 1
+        self.stats['busy_time'] += time_to_process + transmission_time
+        return time_to_process, transmission_time
+
+class ServicePool:
+    """Pool of service units fed from one shared queue or from per-unit queues.
+
+    The pool is used by `Simulation` in place of a single queue: `enqueue`
+    dispatches to a unit queue according to `policy`, and `items`, `stats`,
+    `capacity` and `drop_probability` give the aggregate view read by the
+    statistics collector.
+    """
+
+    POLICIES = ('shared', 'round_robin', 'shortest_queue', 'flow_hash')
+
+    def __init__(self, queue_factory: Callable[[int], Any], link_factory: Callable[[], Any],
+                 service_rates: List[int], capacity: int, policy: str = 'shared'):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown dispatch policy '{policy}', expected one of {self.POLICIES}")
+        if not service_rates:
+            raise ValueError("ServicePool needs at least one service rate")
+        self.policy = policy
+        if policy == 'shared':
+            self.queues = [queue_factory(capacity)]
+        else:
+            # Split the buffer so the total capacity does not grow with the unit count
+            unit_capacity = max(capacity // len(service_rates), 1)
+            self.queues = [queue_factory(unit_capacity) for _ in service_rates]
+        self.units = [
+            ServiceUnit(i, self.queues[0] if policy == 'shared' else self.queues[i], rate, link_factory())
+            for i, rate in enumerate(service_rates)
+        ]
+        self.next_unit = 0  # Round-robin position
+        # Written by the generator and every unit thread, merged when read
+        self.counters = ThreadCounters({
+            'total_packets': 0,
+            'total_processed': 0,
+            'total_dropped': 0,
+            'total_processing_time': 0,
+            'total_transmission_time': 0,
+            'total_queue_delay': 0,
+            'queue_delay_count': 0,
+            'last_queue_delay': 0.0
+        }, gauges=('last_queue_delay',))
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        """Merged pool statistics."""
+        return self.counters.snapshot()
+
+    @stats.setter
+    def stats(self, values: Dict[str, float]) -> None:
+        self.counters.reset(values)
+
+    def add_stat(self, name: str, value: float = 1) -> None:
+        """Add to a pool statistics counter from any thread."""
+        self.counters.add(name, value)
+
+    @property
+    def items(self) -> List[Any]:
+        """All packets currently waiting, across every queue."""
+        return [packet for queue in self.queues for packet in queue.items]
+
+    @property
+    def capacity(self) -> int:
+        """Total buffer capacity of the pool in packets."""
+        return sum(queue.capacity for queue in self.queues)
+
+    @property
+    def queued_bytes(self) -> int:
+        """Bytes currently waiting, across every queue."""
+        return sum(queue.queued_bytes for queue in self.queues)
+
+    def drops_by_cause(self) -> Dict[str, int]:
+        """Early (AQM) and overflow drops summed over the unit queues."""
+        return {
+            'early': sum(queue.stats['early_drops'] for queue in self.queues),
+            'overflow': sum(queue.stats['overflow_drops'] for queue in self.queues)
+        }
+
+    def controller_stats(self) -> Dict[str, float]:
+        """AQM controller state of every unit queue, keyed 'unit<i>.<name>'."""
+        stats = {}
+        for i, queue in enumerate(self.queues):
+            if hasattr(queue, 'controller_stats'):
+                for name, value in queue.controller_stats().items():
+                    stats[f'unit{i}.{name}'] = value
+        return stats
+
+    @property
+    def drop_probability(self) -> float:
+        """Mean AQM drop probability across queues (0 for tail-drop queues)."""
+        return sum(getattr(queue, 'drop_probability', 0.0) for queue in self.queues) / len(self.queues)
+
+    def is_empty(self) -> bool:
+        """Check if every queue is empty."""
+        return all(queue.is_empty() for queue in self.queues)
+
+    def _select_queue(self, packet: Any) -> Any:
+        """Pick the queue a packet is dispatched to."""
+        if self.policy == 'shared':
+            return self.queues[0]
+        if self.policy == 'round_robin':
+            queue = self.queues[self.next_unit]
+            self.next_unit = (self.next_unit + 1) % len(self.queues)
+            return queue
+        if self.policy == 'shortest_queue':
+            return min(self.queues, key=lambda queue: len(queue.items))
+        # flow_hash: crc32 keeps the mapping stable across runs, unlike hash()
+        key = packet.flow if packet.flow is not None else packet.packet_id
+        return self.queues[zlib.crc32(repr(key).encode()) % len(self.queues)]
+
+    def enqueue(self, packet: Optional[Any]) -> bool:
+        """Dispatch a packet to a unit queue; None stops every unit."""
+        if packet is None:
+            for unit in self.units:
+                unit.queue.enqueue(None)
+            return True
+        if self._select_queue(packet).enqueue(packet):
+            return True
+        self.counters.add('total_dropped')
+        return False
+
+    def _run_unit(self, unit: ServiceUnit, sim_start_time: float,
+                  on_served: Optional[Callable[[Any, ServiceUnit], None]],
+                  interrupted: Optional[threading.Event]) -> None:
+        """Serve packets from the unit's queue until it receives the stop signal or is interrupted."""
+        while interrupted is None or not interrupted.is_set():
+            packet = unit.queue.get()
+            if packet is None:
+                break
+            processing_time, transmission_time = unit.serve(packet, sim_start_time)
+            # Count the packet in the same step that ends its service, so a checkpoint sees one or the other
+            unit.queue.finish(lambda served: self._count_served(served, unit, processing_time,
+                                                                transmission_time, on_served))
+
+    def _count_served(self, packet: Any, unit: ServiceUnit, processing_time: float, transmission_time: float,
+                      on_served: Optional[Callable[[Any, ServiceUnit], None]]) -> None:
+        """Update the pool statistics for a served packet and pass it to `on_served` (queue lock held)."""
+        queue_delay = packet.start_processing_time - packet.creation_time
+        self.counters.add('total_processed')
+        self.counters.add('total_processing_time', processing_time)
+        self.counters.add('total_transmission_time', transmission_time)
+        self.counters.add('total_queue_delay', queue_delay)
+        self.counters.add('queue_delay_count')
+        self.counters.set('last_queue_delay', queue_delay)
+        if on_served is not None:
+            on_served(packet, unit)
+
+    def run(self, sim_start_time: float,
+            on_served: Optional[Callable[[Any, ServiceUnit], None]] = None,
+            interrupted: Optional[threading.Event] = None) -> None:
+        """Start one thread per unit and wait until all of them have stopped.
+
+        Once `interrupted` is set, units stop after their current packet and
+        leave the rest queued (for a checkpoint).
+        """
+        threads = [
+            threading.Thread(target=self._run_unit, args=(unit, sim_start_time, on_served, interrupted))
+            for unit in self.units
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def unit_summary(self) -> List[Dict[str, float]]:
+        """Per-unit rate, processed count and busy time."""
+        return [
+            {'unit': unit.unit_id, 'rate': unit.processing_speed,
+             'processed': unit.stats['processed'], 'busy_time': unit.stats['busy_time']}
+            for unit in self.units
+        ]
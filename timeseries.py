@@ -0,0 +1,192 @@
+import math
+from array import array
+from typing import Optional, List, Dict
+
+class RollupLevel:
+    """Fixed-size array of min/max/sum/count buckets at one time resolution.
+
+    A level either wraps around (keeping the most recent `capacity` buckets)
+    or compacts, merging neighbouring buckets and doubling its resolution so
+    it always spans the whole run.
+    """
+
+    def __init__(self, resolution: float, capacity: int, wrap: bool):
+        if capacity < 2:
+            raise ValueError("RollupLevel needs a capacity of at least 2 buckets")  # Compaction merges pairs
+        self.resolution = resolution  # seconds per bucket
+        self.capacity = capacity
+        self.wrap = wrap
+        self.bucket_ids = array('q', [0] * capacity)
+        self.minimum = array('d', [0.0] * capacity)
+        self.maximum = array('d', [0.0] * capacity)
+        self.total = array('d', [0.0] * capacity)
+        self.count = array('q', [0] * capacity)
+        self.start = 0  # Slot of the oldest bucket
+        self.length = 0
+
+    def _slot(self, i: int) -> int:
+        """Map the i-th oldest bucket to its array slot."""
+        return (self.start + i) % self.capacity
+
+    def add(self, timestamp: float, value: float) -> None:
+        """Fold one sample into its bucket."""
+        bucket_id = int(timestamp // self.resolution)
+        if self.length:
+            last = self._slot(self.length - 1)
+            if self.bucket_ids[last] >= bucket_id:
+                self.minimum[last] = min(self.minimum[last], value)
+                self.maximum[last] = max(self.maximum[last], value)
+                self.total[last] += value
+                self.count[last] += 1
+                return
+        if self.length == self.capacity:
+            if self.wrap:
+                self.start = self._slot(1)
+                self.length -= 1
+            else:
+                # Sparse buckets may not merge in one pass; halve until a slot is free
+                while self.length == self.capacity:
+                    self._compact()
+                bucket_id = int(timestamp // self.resolution)
+                last = self.length - 1
+                if self.bucket_ids[last] >= bucket_id:
+                    self.add(timestamp, value)
+                    return
+        slot = self._slot(self.length)
+        self.bucket_ids[slot] = bucket_id
+        self.minimum[slot] = value
+        self.maximum[slot] = value
+        self.total[slot] = value
+        self.count[slot] = 1
+        self.length += 1
+
+    def _compact(self) -> None:
+        """Merge buckets pairwise at double resolution (non-wrapping levels only)."""
+        self.resolution *= 2
+        merged = 0
+        for i in range(self.length):
+            bucket_id = self.bucket_ids[i] // 2
+            if merged and self.bucket_ids[merged - 1] == bucket_id:
+                j = merged - 1
+                self.minimum[j] = min(self.minimum[j], self.minimum[i])
+                self.maximum[j] = max(self.maximum[j], self.maximum[i])
+                self.total[j] += self.total[i]
+                self.count[j] += self.count[i]
+                continue
+            self.bucket_ids[merged] = bucket_id
+            self.minimum[merged] = self.minimum[i]
+            self.maximum[merged] = self.maximum[i]
+            self.total[merged] = self.total[i]
+            self.count[merged] = self.count[i]
+            merged += 1
+        self.length = merged
+
+    def first_time(self) -> float:
+        """Start time of the oldest bucket held."""
+        return self.bucket_ids[self._slot(0)] * self.resolution if self.length else 0.0
+
+    def buckets(self) -> Dict[str, List[float]]:
+        """Return bucket mid-times with their min, max and mean, oldest first."""
+        result = {'time': [], 'min': [], 'max': [], 'mean': []}
+        for i in range(self.length):
+            slot = self._slot(i)
+            result['time'].append((self.bucket_ids[slot] + 0.5) * self.resolution)
+            result['min'].append(self.minimum[slot])
+            result['max'].append(self.maximum[slot])
+            result['mean'].append(self.total[slot] / self.count[slot])
+        return result
+
+class RollupSeries:
+    """Constant-memory time series with multi-resolution min/max/mean rollups.
+
+    Each sample is folded into `levels` RollupLevels whose resolution grows by
+    `factor`; the finer levels keep the most recent `capacity` buckets and the
+    coarsest one compacts so the whole run is always covered.
+    """
+
+    def __init__(self, base_resolution: float = 0.1, capacity: int = 600,
+                 levels: int = 3, factor: int = 10):
+        if capacity < 2:
+            raise ValueError("RollupSeries needs a capacity of at least 2 buckets per level")
+        self.levels = [
+            RollupLevel(base_resolution * factor ** i, capacity, wrap=(i < levels - 1))
+            for i in range(levels)
+        ]
+        self.first_timestamp = None
+        self.last_value = 0.0
+
+    def add(self, timestamp: float, value: float) -> None:
+        """Record one sample at every resolution."""
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamp
+        self.last_value = value
+        for level in self.levels:
+            level.add(timestamp, value)
+
+    def buckets(self, level: Optional[int] = None) -> Dict[str, List[float]]:
+        """Return the rollup of one level, by default the finest that covers the whole run."""
+        if level is None:
+            level = len(self.levels) - 1
+            for i, candidate in enumerate(self.levels):
+                if candidate.length and candidate.first_time() <= (self.first_timestamp or 0.0):
+                    level = i
+                    break
+        return self.levels[level].buckets()
+
+    def downsample(self, max_points: int = 1000) -> Dict[str, List[float]]:
+        """Return at most `max_points` buckets chosen by LTTB on the bucket means."""
+        buckets = self.buckets()
+        keep = largest_triangle_three_buckets(buckets['time'], buckets['mean'], max_points)
+        return {key: [values[i] for i in keep] for key, values in buckets.items()}
+
+def largest_triangle_three_buckets(x: List[float], y: List[float], threshold: int) -> List[int]:
+    """Indices of the points kept by the Largest-Triangle-Three-Buckets downsampling."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    selected = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third vertex of the triangle
+        next_start = int(math.floor((i + 1) * every)) + 1
+        next_end = min(int(math.floor((i + 2) * every)) + 1, n)
+        avg_x = sum(x[next_start:next_end]) / (next_end - next_start)
+        avg_y = sum(y[next_start:next_end]) / (next_end - next_start)
+
+        start = int(math.floor(i * every)) + 1
+        end = int(math.floor((i + 1) * every)) + 1
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((x[a] - avg_x) * (y[j] - y[a]) - (x[a] - x[j]) * (avg_y - y[a]))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return selected
+
+class SlidingWindowRate:
+    """Events per second over the last `window` seconds, kept in a fixed ring of slots."""
+
+    def __init__(self, window: float = 1.0, slots: int = 20):
+        self.window = window
+        self.slot_width = window / slots
+        self.counts = array('d', [0.0] * slots)
+        self.slot_ids = array('q', [-1] * slots)
+
+    def add(self, timestamp: float, count: float = 1.0) -> None:
+        """Record `count` events at `timestamp`."""
+        slot_id = int(timestamp // self.slot_width)
+        i = slot_id % len(self.counts)
+        if self.slot_ids[i] != slot_id:
+            self.slot_ids[i] = slot_id
+            self.counts[i] = 0.0
+        self.counts[i] += count
+
+    def rate(self, timestamp: float) -> float:
+        """Events per second in the window ending at `timestamp`."""
+        current = int(timestamp // self.slot_width)
+        oldest = current - len(self.counts) + 1
+        total = sum(c for c, s in zip(self.counts, self.slot_ids) if oldest <= s <= current)
+        return total / self.window
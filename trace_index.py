@@ -0,0 +1,249 @@
+import os
+import sys
+import csv
+import struct
+from array import array
+from bisect import bisect_left
+from typing import Optional, List, Dict, Iterable, Iterator, Tuple
+
+FlowKey = Tuple[str, str, int, int, int]
+
+def flow_key(row: Dict[str, str]) -> FlowKey:
+    """Build the (ip_src, ip_dst, src_port, dst_port, proto) key of a trace row."""
+    return (row['ip_src'], row['ip_dst'], int(row['src_port']),
+            int(row['dst_port']), int(row['proto']))
+
+class TraceIndex:
+    """Sparse timestamp -> (row, byte offset) index over a packet capture CSV.
+
+    The index keeps one entry every `stride` rows and is stored next to the
+    trace as `<csv_file>.idx`, so it is built once and reused until the CSV
+    changes. Seeks are a binary search over the entries followed by a scan of
+    at most `stride` rows.
+    """
+
+    MAGIC = b'TIDX'
+    VERSION = 1
+    HEADER = struct.Struct('<4sHIqqqdd')
+
+    def __init__(self, csv_file: str, stride: int = 256):
+        self.csv_file = csv_file
+        self.index_file = csv_file + '.idx'
+        self.stride = stride
+        self.times = array('d')
+        self.rows = array('q')
+        self.offsets = array('q')
+        self.total_rows = 0
+        self.first_time = 0.0
+        self.last_time = 0.0
+        self.fieldnames: List[str] = []
+
+    @classmethod
+    def open(cls, csv_file: str, stride: int = 256) -> 'TraceIndex':
+        """Load the index stored next to `csv_file`, rebuilding it if missing or stale."""
+        index = cls(csv_file, stride)
+        if not index._load():
+            index.build()
+            index.save()
+        return index
+
+    def _csv_signature(self) -> Tuple[int, int]:
+        """Return (size, mtime_ns) of the CSV, used to detect a stale index."""
+        st = os.stat(self.csv_file)
+        return st.st_size, st.st_mtime_ns
+
+    def build(self) -> None:
+        """Scan the whole CSV once and record every `stride`-th row."""
+        self.times = array('d')
+        self.rows = array('q')
+        self.offsets = array('q')
+        with open(self.csv_file, 'rb') as f:
+            header = f.readline()
+            self.fieldnames = next(csv.reader([header.decode()]))
+            time_col = self.fieldnames.index('time')
+            offset = f.tell()
+            row = 0
+            last = float('-inf')
+            for line in iter(f.readline, b''):
+                if not line.strip():
+                    offset += len(line)
+                    continue
+                timestamp = float(line.split(b',', time_col + 1)[time_col])
+                if timestamp < last:
+                    raise ValueError(f"Trace '{self.csv_file}' is not sorted by time at row {row}")
+                if row == 0:
+                    self.first_time = timestamp
+                if row % self.stride == 0:
+                    self.times.append(timestamp)
+                    self.rows.append(row)
+                    self.offsets.append(offset)
+                last = timestamp
+                offset += len(line)
+                row += 1
+        self.total_rows = row
+        self.last_time = last if row else 0.0
+
+    def save(self) -> None:
+        """Write the index to `<csv_file>.idx`."""
+        size, mtime_ns = self._csv_signature()
+        header_line = ','.join(self.fieldnames).encode()
+        with open(self.index_file, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.stride, self.total_rows,
+                                     size, mtime_ns, self.first_time, self.last_time))
+            f.write(struct.pack('<I', len(header_line)))
+            f.write(header_line)
+            f.write(struct.pack('<I', len(self.times)))
+            self.times.tofile(f)
+            self.rows.tofile(f)
+            self.offsets.tofile(f)
+
+    def _load(self) -> bool:
+        """Read `<csv_file>.idx`; return False if it is missing, foreign or stale."""
+        try:
+            with open(self.index_file, 'rb') as f:
+                magic, version, stride, total_rows, size, mtime_ns, first_time, last_time = \
+                    self.HEADER.unpack(f.read(self.HEADER.size))
+                if magic != self.MAGIC or version != self.VERSION or stride != self.stride:
+                    return False
+                if (size, mtime_ns) != self._csv_signature():
+                    return False
+                (header_len,) = struct.unpack('<I', f.read(4))
+                self.fieldnames = f.read(header_len).decode().split(',')
+                (entries,) = struct.unpack('<I', f.read(4))
+                self.times.fromfile(f, entries)
+                self.rows.fromfile(f, entries)
+                self.offsets.fromfile(f, entries)
+        except (OSError, struct.error, EOFError, ValueError):
+            self.times, self.rows, self.offsets = array('d'), array('q'), array('q')
+            return False
+        self.total_rows = total_rows
+        self.first_time = first_time
+        self.last_time = last_time
+        return True
+
+    @property
+    def duration(self) -> float:
+        """Time span covered by the trace in seconds."""
+        return self.last_time - self.first_time
+
+    def locate_time(self, timestamp: float) -> Tuple[int, int]:
+        """Return (row, offset) of the index entry at or before an absolute timestamp."""
+        if not self.times:
+            return 0, 0
+        # Last entry strictly before the timestamp: earlier rows may share it
+        i = max(bisect_left(self.times, timestamp) - 1, 0)
+        return self.rows[i], self.offsets[i]
+
+    def locate_row(self, row: int) -> Tuple[int, int]:
+        """Return (row, offset) of the index entry at or before a row number."""
+        if not self.rows:
+            return 0, 0
+        i = min(row // self.stride, len(self.rows) - 1)
+        return self.rows[i], self.offsets[i]
+
+class TraceReader:
+    """Streams one time window of an indexed trace without loading the file.
+
+    `start` and `end` are seconds relative to the first packet of the trace.
+    `flows` optionally restricts the replay to a set of flow keys, matched in
+    either direction. Yielded packets carry `time` relative to `start`.
+    """
+
+    def __init__(self, index: TraceIndex, start: float = 0.0, end: Optional[float] = None,
+                 flows: Optional[Iterable[FlowKey]] = None, start_row: int = 0):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.start_row = start_row
+        self.flows = None
+        if flows is not None:
+            self.flows = set()
+            for src, dst, sport, dport, proto in flows:
+                self.flows.add((src, dst, sport, dport, proto))
+                self.flows.add((dst, src, dport, sport, proto))
+        self.position = start_row  # Next trace row to be read
+
+    @property
+    def duration(self) -> float:
+        """Length of the replay window in seconds."""
+        end = self.index.duration if self.end is None else min(self.end, self.index.duration)
+        return max(end - self.start, 0.0)
+
+    def resume_at(self, row: int) -> 'TraceReader':
+        """Return a reader over the same window that continues from trace row `row`."""
+        return TraceReader(self.index, self.start, self.end, flows=self.flows, start_row=row)
+
+    def _length_column(self) -> str:
+        """Return the packet size column name used by this trace."""
+        return 'data_length' if 'data_length' in self.index.fieldnames else 'data_len'
+
+    def __iter__(self) -> Iterator[Dict]:
+        index = self.index
+        start_time = index.first_time + self.start
+        end_time = None if self.end is None else index.first_time + self.end
+        length_col = self._length_column()
+        row, offset = index.locate_time(start_time)
+        if self.start_row > row:
+            row, offset = index.locate_row(self.start_row)
+
+        with open(index.csv_file, 'rb') as f:
+            f.seek(offset)
+            for line in iter(f.readline, b''):
+                if not line.strip():
+                    continue
+                values = dict(zip(index.fieldnames, next(csv.reader([line.decode()]))))
+                current_row = row
+                row += 1
+                timestamp = float(values['time'])
+                if end_time is not None and timestamp >= end_time:
+                    break
+                if timestamp < start_time or current_row < self.start_row:
+                    continue
+                self.position = row
+                if self.flows is not None and flow_key(values) not in self.flows:
+                    continue
+                yield {
+                    'packet_id': int(values['packet_id']),
+                    'data_length': int(values[length_col]),
+                    'time': timestamp - start_time,
+                    'flow': flow_key(values),
+                }
+
+class StitchedTrace:
+    """Concatenates trace windows back to back, optionally looping to a target duration.
+
+    Each segment is shifted to start where the previous one ended and packets
+    are renumbered so ids stay unique across loops.
+    """
+
+    def __init__(self, segments: List[TraceReader], target_duration: Optional[float] = None):
+        if not segments:
+            raise ValueError("StitchedTrace needs at least one segment")
+        self.segments = segments
+        self.target_duration = target_duration
+
+    def __iter__(self) -> Iterator[Dict]:
+        offset = 0.0
+        packet_id = 0
+        while True:
+            for segment in self.segments:
+                for packet in segment:
+                    packet_time = offset + packet['time']
+                    if self.target_duration is not None and packet_time >= self.target_duration:
+                        return
+                    packet = dict(packet, packet_id=packet_id, time=packet_time)
+                    packet_id += 1
+                    yield packet
+                offset += segment.duration
+            if self.target_duration is None or offset <= 0:
+                return
+
+def main():
+    """Build (or refresh) the index of each CSV given on the command line."""
+    for csv_file in sys.argv[1:]:
+        index = TraceIndex.open(csv_file)
+        print(f"{csv_file}: {index.total_rows} packets, {index.duration:.2f}s, "
+              f"{len(index.times)} index entries -> {index.index_file}")
+
+if __name__ == "__main__":
+    main()